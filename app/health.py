@@ -0,0 +1,83 @@
+import concurrent.futures
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy.sql import text
+
+from shared import backends
+from shared.database import SessionLocal, replica_engines
+from shared.settings import settings
+from .sensors.controller import get_publisher
+
+# Liveness: el procés respon. Readiness: les bases de dades (i la cua, si s'hi publiquen les lectures o els avisos) responen,
+# i per tant la instància pot rebre tràfic. Cada comprovació té un temps màxim perquè un servei penjat no bloquegi la resposta
+
+router = APIRouter(
+    prefix="/health",
+    tags=["health"],
+)
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="health")
+
+def _check_postgres():
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+    return True
+
+def _check_replica(replica):
+    def check():
+        with replica.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    return check
+
+def _ping(factory):
+    def check():
+        client = factory()
+        try:
+            return client.ping()
+        finally:
+            client.close()
+    return check
+
+def _check_rabbitmq():
+    return get_publisher().status()["connected"]
+
+def checks() -> dict:
+    registered = {
+        "postgres": _check_postgres,
+        "timescale": _ping(backends.timescale),
+        "redis": _ping(backends.redis_client),
+        "mongodb": _ping(backends.mongodb_client),
+        "elasticsearch": _ping(backends.elasticsearch_client),
+        "cassandra": _ping(backends.cassandra_client),
+    }
+    for replica in replica_engines:
+        # Diverses rèpliques poden ser al mateix host amb ports diferents
+        registered[f"postgres_replica_{replica.url.host}:{replica.url.port or 5432}"] = _check_replica(replica)
+    if settings.ingest_via_queue or settings.battery_alerts:
+        registered["rabbitmq"] = _check_rabbitmq
+    return registered
+
+@router.get("/live")
+def live():
+    return {"status": "alive"}
+
+@router.get("/ready")
+def ready():
+    # Totes les comprovacions es fan en paral·lel i comparteixen el mateix temps màxim
+    futures = {name: _executor.submit(check) for name, check in checks().items()}
+    concurrent.futures.wait(futures.values(), timeout=settings.readiness_timeout)
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = "timeout"
+        elif future.exception() is not None:
+            results[name] = f"error: {future.exception()!r}"
+        else:
+            results[name] = "ok" if future.result() else "unavailable"
+    ready = all(result == "ok" for result in results.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"status": "ready" if ready else "unavailable", "checks": results})
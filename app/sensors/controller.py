@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException,Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from shared.publisher import Publisher
+from shared import backends, connections
 from shared.database import SessionLocal
 from shared.redis_client import RedisClient
 from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient 
 from shared.timescale import Timescale
 from shared.cassandra_client import CassandraClient
-from shared.sensors import models, schemas, repository
+from shared.sensors import models, schemas, repository, stream
+from shared.publisher import EXAMPLE_QUEUE
+from shared.sensors.messages import SensorDataMessage
+from shared.settings import settings
 import json
 # Dependency to get db session
 def get_db():
@@ -18,7 +23,7 @@ def get_db():
         db.close()
 
 def get_timescale():
-    ts = Timescale()
+    ts = backends.timescale()
     try:
         yield ts
     finally:
@@ -26,7 +31,7 @@ def get_timescale():
 
 # Dependency to get redis client
 def get_redis_client():
-    redis = RedisClient(host="redis")
+    redis = backends.redis_client()
     try:
         yield redis
     finally:
@@ -34,7 +39,7 @@ def get_redis_client():
 
 # Dependency to get mongodb client
 def get_mongodb_client():
-    mongodb = MongoDBClient(host="mongodb")
+    mongodb = backends.mongodb_client()
     try:
         yield mongodb
     finally:
@@ -42,7 +47,7 @@ def get_mongodb_client():
 
 # Dependency to get elastic_search client
 def get_elastic_search():
-    es = ElasticsearchClient(host="elasticsearch")
+    es = backends.elasticsearch_client()
     try:
         yield es
     finally:
@@ -50,12 +55,24 @@ def get_elastic_search():
 
 # Dependency to get cassandra client
 def get_cassandra_client():
-    cassandra = CassandraClient(hosts=["cassandra"])
+    cassandra = backends.cassandra_client()
     try:
         yield cassandra
     finally:
         cassandra.close()
 
+# El publicador es crea la primera vegada que es fa servir: arrencar l'API no depèn de RabbitMQ.
+# N'hi ha un per procés: el fil de publicació no sobreviu a un fork, i cada worker en crea el seu
+def get_publisher():
+    return connections.per_process("publisher", lambda: backends.publisher(
+        shards=settings.queue_shards, buffer_size=settings.publisher_buffer_size,
+        max_length=settings.queue_max_length, overflow=settings.queue_overflow))
+
+def close_publisher():
+    publisher = connections.discard("publisher")
+    if publisher is not None:
+        publisher.close()
+
 router = APIRouter(
     prefix="/sensors",
     responses={404: {"description": "Not found"}},
@@ -90,9 +107,65 @@ def get_temperature_values(mongoDB: MongoDBClient = Depends(get_mongodb_client),
 def get_sensors_quantity(db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
     return repository.get_sensors_quantity(db=db, cassandra=cassandra_client)
 
+# Estadístiques de tota la flota: mitjanes per tipus, sensors més calents i anomalies (puntuació z respecte als sensors del mateix tipus)
+# Parameters:
+# - from, to (optional): interval de les lectures
+# - top (optional): nombre de sensors més calents
+# - z (optional): puntuació z a partir de la qual un sensor és una anomalia
+@router.get("/analytics")
+def get_fleet_analytics(request: Request, top: int = 5, z: float = 2.0, timescale: Timescale = Depends(get_timescale)):
+    from_date = request.query_params.get('from', None)
+    to_date = request.query_params.get('to', None)
+    return repository.get_fleet_analytics(timescale=timescale, from_date=from_date, to_date=to_date, top=top, z_threshold=z)
+
 @router.get("/low_battery")
-def get_low_battery_sensors(mongoDB: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_low_battery_sensors(mongodb=mongoDB, cassandra=cassandra_client)
+def get_low_battery_sensors(mongoDB: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.get_low_battery_sensors(mongodb=mongoDB, redis=redis_client)
+
+# Retorna l'última lectura de diversos sensors en una sola crida
+# Parameters:
+# - ids: identificadors dels sensors separats per comes
+# - fields (optional): camps a retornar separats per comes
+@router.get("/latest")
+def get_latest_sensors_data(ids: str, fields: str = None, redis_client: RedisClient = Depends(get_redis_client)):
+    try:
+        sensor_ids = [int(sensor_id) for sensor_id in ids.split(",") if sensor_id]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of integers")
+    fields = [field for field in fields.split(",") if field] if fields else None
+    return repository.get_latest_sensors_data(redis=redis_client, sensor_ids=sensor_ids, fields=fields)
+
+# Subscripció a les lectures en directe amb Server-Sent Events
+# Parameters:
+# - ids (optional): identificadors dels sensors separats per comes
+# - type (optional): tipus de sensor
+# - latitude, longitude, radius (optional): zona, com a /near
+# Sense filtres es reben les lectures de tots els sensors
+@router.get("/stream")
+async def stream_readings(request: Request, ids: str = None, type: str = None, latitude: float = None, longitude: float = None, radius: float = None, mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+    try:
+        sensor_ids = [int(sensor_id) for sensor_id in ids.split(",") if sensor_id] if ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of integers")
+    if (latitude, longitude, radius).count(None) not in (0, 3):
+        raise HTTPException(status_code=400, detail="latitude, longitude and radius must be given together")
+    #La consulta a mongoDB és bloquejant: la fem en un fil per no aturar el bucle d'esdeveniments
+    sensor_ids = await run_in_threadpool(repository.get_stream_sensor_ids, mongodb=mongodb_client, sensor_ids=sensor_ids, sensor_type=type,
+                                         latitude=latitude, longitude=longitude, radius=radius)
+    subscription = stream.hub().subscribe(sensor_ids, settings.stream_buffer_size)
+
+    async def events():
+        try:
+            async for event in stream.events(subscription, request, settings.stream_heartbeat):
+                yield event
+        finally:
+            stream.hub().unsubscribe(subscription)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Estat de la cua d'ingesta: buffer local del publicador, missatges pendents i consumidors de cada cua
+@router.get("/ingest/status")
+def get_ingest_status(publisher=Depends(get_publisher)):
+    return publisher.status()
 
 # 🙋🏽‍♀️ Add here the route to get all sensors
 @router.get("")
@@ -102,16 +175,19 @@ def get_sensors(db: Session = Depends(get_db)):
 
 # 🙋🏽‍♀️ Add here the route to create a sensor
 @router.post("")
-def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client),elastic:ElasticsearchClient=Depends(get_elastic_search),cassandra_client: CassandraClient =Depends(get_cassandra_client)):
+def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client),elastic:ElasticsearchClient=Depends(get_elastic_search),cassandra_client: CassandraClient =Depends(get_cassandra_client),timescale:Timescale=Depends(get_timescale)):
     db_sensor = repository.get_sensor_by_name(db, sensor.name)
     if db_sensor:
         raise HTTPException(status_code=400, detail="Sensor with same name already registered")
-    return repository.create_sensor(db=db, sensor=sensor,mongoDB=mongodb_client,elastic=elastic,cassandra=cassandra_client)
+    return repository.create_sensor(db=db, sensor=sensor,mongoDB=mongodb_client,elastic=elastic,cassandra=cassandra_client,timescale=timescale)
 
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
 @router.get("/{sensor_id}")
 def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
     db_sensor = repository.get_sensor_mongoDB(mongodb_client, sensor_id)
+    #Si mongoDB no el té potser encara no s'hi ha propagat: el busquem a PostgreSQL
+    if db_sensor is None:
+        db_sensor = repository.get_pending_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
     return db_sensor
@@ -133,8 +209,21 @@ def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(g
     #Si no el troba llança una excepció
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")    
-    #Enregistra les dades del sensor a Redis
-    return repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data,timescale=timescale,cassandra=cassandra_client)
+    #Publica la lectura a la cua perquè l'escrigui el consumidor
+    if settings.ingest_via_queue:
+        publisher = get_publisher()
+        message = SensorDataMessage(sensor_id, data)
+        #Si la cua del sensor està sobrecarregada, o bé només guardem l'última lectura de cada sensor o bé demanem al sensor que ho torni a provar
+        overloaded = publisher.overloaded(sensor_id)
+        if overloaded and settings.overload_policy == "coalesce":
+            publisher.publish(message, coalesce=True)
+        elif overloaded or not publisher.publish(message):
+            raise HTTPException(status_code=429, detail="Ingest overloaded", headers={"Retry-After": str(settings.ingest_retry_after)})
+        return data
+    #Enregistra les dades del sensor a Redis i, si els avisos estan activats, publica els de bateria baixa.
+    #Sense avisos no cal crear el publicador ni, per tant, connectar-se a RabbitMQ
+    publisher = get_publisher() if settings.battery_alerts else None
+    return repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data,timescale=timescale,cassandra=cassandra_client,publisher=publisher)
 
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
 @router.get("/{sensor_id}/data")
@@ -151,16 +240,22 @@ def get_data(sensor_id: int,request: Request,db: Session = Depends(get_db) ,redi
     # Actualitza les dades del sensor amb la informació obtinguda de Redis
     return repository.get_data(timescale=timescale,redis=redis_client, sensor_id=sensor_id,sensor_name=db_sensor.name,from_date=from_date,to_date=to_date,bucket=bucket)
 
-publisher = Publisher()
-
 class ExamplePayload():
+    content_type = "application/json"
+    # No és una lectura: va a la cua d'exemple a través de l'exchange per defecte, no a la cua d'ingesta d'un sensor
+    exchange = ""
+    routing_key = EXAMPLE_QUEUE
+
     def __init__(self, example):
         self.example = example
 
     def to_json(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+        return json.dumps(self, default=lambda o: o.__dict__, separators=(",", ":"))
+
+    def to_bytes(self):
+        return self.to_json().encode()
 @router.post("/exemple/queue")
-def exemple_queue():
+def exemple_queue(publisher=Depends(get_publisher)):
     # Publish here the data to the queue
     publisher.publish(ExamplePayload("holaaaaa"))
     return {"message": "Data published to the queue"}
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""Genera càrrega contra l'API de sensors i mesura throughput i latència.
+
+Simula una flota de sensors que envien lectures a POST /sensors/{id}/data a un ritme donat, barrejades amb
+lectures de /sensors/near, /sensors/search i /sensors/{id}/data agrupades per intervals.
+
+Ús:
+    python -m benchmarks.load --base-url http://localhost:8000 --sensors 100 --rate 200 --duration 30
+    BACKEND=memory python -m benchmarks.load --in-process ...  # l'app dins del mateix procés, sense contenidors
+    python -m benchmarks.load ... --save-baseline local   # guarda el resultat a benchmarks/baselines/local.json
+    python -m benchmarks.load ... --compare local         # falla si p95 o throughput empitjoren més que --tolerance
+
+La línia base benchmarks/baselines/memory.json s'ha generat amb:
+    BACKEND=memory python -m benchmarks.load --in-process --sensors 50 --rate 100 --duration 20 --seed 1 --save-baseline memory
+i es compara amb la mateixa ordre canviant --save-baseline memory per --compare memory. Les latències depenen de la màquina:
+torneu-la a generar abans de comparar en una altra.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+SENSOR_TYPES = ("Temperatura", "Velocitat")
+DEFAULT_MIX = "write=0.85,latest=0.05,near=0.04,search=0.03,bucketed=0.03"
+
+
+def percentile(values, p):
+    # Percentil pel mètode del rang més proper
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def make_client(args):
+    if args.in_process:
+        from fastapi.testclient import TestClient
+        from app.main import app
+        from shared.settings import settings
+        if settings.ingest_via_queue:
+            # Amb la ingesta per la cua, el consumidor ha de córrer al mateix procés (la cua en memòria és del procés)
+            from consumer import main as consumer
+            threading.Thread(target=consumer.run, name="consumer", daemon=True).start()
+        client = TestClient(app)
+        # Com a context, TestClient executa els esdeveniments startup de l'app (amb BACKEND=memory creen les taules)
+        client.__enter__()
+        return client
+    import httpx
+    return httpx.Client(base_url=args.base_url, timeout=args.timeout)
+
+
+class Fleet:
+    def __init__(self, client, size, prefix):
+        self.client = client
+        self.sensors = []
+        for i in range(size):
+            sensor_type = SENSOR_TYPES[i % len(SENSOR_TYPES)]
+            name = f"{prefix} {i}"
+            response = client.post("/sensors", json={
+                "name": name, "latitude": random.uniform(41.3, 41.5), "longitude": random.uniform(2.1, 2.3),
+                "type": sensor_type, "mac_address": f"02:00:00:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}",
+                "manufacturer": "Bench", "model": f"Bench {sensor_type}", "serie_number": f"{i:016d}",
+                "firmware_version": "1.0", "description": f"Sensor de {sensor_type.lower()} de la flota de benchmark",
+            })
+            if response.status_code == 200:
+                sensor = response.json()
+            else:
+                # Ja existeix d'una execució anterior: el busquem pel nom
+                hits = client.get("/sensors/search", params={"query": json.dumps({"name": name}), "search_type": "match", "size": 1}).json()
+                if not hits:
+                    raise SystemExit(f"Could not create or find sensor {name!r}: {response.status_code} {response.text}")
+                sensor = hits[0]
+            self.sensors.append(sensor)
+        self.clock = {sensor["id"]: datetime.datetime(2024, 1, 1) for sensor in self.sensors}
+        self.lock = threading.Lock()
+
+    def next_timestamp(self, sensor_id):
+        # Cada sensor avança el seu rellotge, així totes les lectures tenen un last_seen diferent
+        with self.lock:
+            self.clock[sensor_id] += datetime.timedelta(seconds=1)
+            return self.clock[sensor_id].strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def op_write(client, fleet):
+    sensor = random.choice(fleet.sensors)
+    data = {"battery_level": round(random.uniform(0.05, 1.0), 2), "last_seen": fleet.next_timestamp(sensor["id"])}
+    if sensor["type"] == "Temperatura":
+        data.update(temperature=round(random.uniform(-5, 35), 1), humidity=round(random.uniform(10, 90), 1))
+    else:
+        data.update(velocity=round(random.uniform(0, 120), 1))
+    return client.post(f"/sensors/{sensor['id']}/data", json=data)
+
+
+def op_latest(client, fleet):
+    ids = ",".join(str(sensor["id"]) for sensor in random.sample(fleet.sensors, min(20, len(fleet.sensors))))
+    return client.get("/sensors/latest", params={"ids": ids})
+
+
+def op_near(client, fleet):
+    sensor = random.choice(fleet.sensors)
+    return client.get("/sensors/near", params={"latitude": sensor["latitude"], "longitude": sensor["longitude"], "radius": 0.05})
+
+
+def op_search(client, fleet):
+    return client.get("/sensors/search", params={"query": json.dumps({"type": random.choice(SENSOR_TYPES)}), "size": 10})
+
+
+def op_bucketed(client, fleet):
+    sensor = random.choice(fleet.sensors)
+    return client.get(f"/sensors/{sensor['id']}/data", params={"from": "2024-01-01T00:00:00.000Z", "to": "2024-01-02T00:00:00.000Z", "bucket": "hour"})
+
+
+OPERATIONS = {"write": op_write, "latest": op_latest, "near": op_near, "search": op_search, "bucketed": op_bucketed}
+
+
+def run(client, fleet, weights, rate, duration, concurrency):
+    # Bucle obert: cada fil llança peticions a rate/concurrency per segon, encara que l'API vagi lenta
+    names, cumulative = list(weights), []
+    total = 0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    interval = concurrency / rate
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker(offset):
+        next_at = start + offset * interval / concurrency
+        while True:
+            now = time.perf_counter()
+            if next_at >= deadline:
+                return
+            if next_at > now:
+                time.sleep(next_at - now)
+            next_at += interval
+            pick = random.uniform(0, total)
+            name = next(n for n, c in zip(names, cumulative) if pick <= c)
+            t0 = time.perf_counter()
+            try:
+                ok = OPERATIONS[name](client, fleet).status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies[name].append(elapsed)
+                if not ok:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies, errors, elapsed):
+    def stats(values, failed):
+        return {
+            "requests": len(values),
+            "errors": failed,
+            "throughput": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000 if values else None,
+            "p95_ms": percentile(values, 95) * 1000 if values else None,
+            "p99_ms": percentile(values, 99) * 1000 if values else None,
+        }
+    result = {name: stats(values, errors[name]) for name, values in sorted(latencies.items())}
+    result["total"] = stats([v for values in latencies.values() for v in values], sum(errors.values()))
+    return result
+
+
+def print_report(result):
+    print(f"{'operation':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result.items():
+        p = [f"{stats[k]:>10.2f}" if stats[k] is not None else f"{'-':>10}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:<12}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>10.1f}{''.join(p)}")
+
+
+def compare(result, baseline, tolerance):
+    # Regressió si el p95 puja o el throughput baixa més que la tolerància respecte a la línia base
+    regressions = []
+    for name, stats in result.items():
+        base = baseline.get(name)
+        if not base or not stats["requests"]:
+            continue
+        if base["p95_ms"] and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {stats['p95_ms']:.2f}ms vs baseline {base['p95_ms']:.2f}ms")
+        if stats["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: {stats['throughput']:.1f} req/s vs baseline {base['throughput']:.1f} req/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for the sensors API")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", default="http://localhost:8000")
+    target.add_argument("--in-process", action="store_true", help="run the app in this process instead of calling a server")
+    parser.add_argument("--sensors", type=int, default=50, help="size of the simulated fleet")
+    parser.add_argument("--rate", type=float, default=100, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--prefix", default="Bench sensor", help="name prefix of the fleet sensors")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the result as JSON to this file")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    weights = parse_mix(args.mix)
+    client = make_client(args)
+    fleet = Fleet(client, args.sensors, args.prefix)
+    result = run(client, fleet, weights, args.rate, args.duration, args.concurrency)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(os.path.join(BASELINES_DIR, f"{args.save_baseline}.json"), "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "output")}, "result": result}, f, indent=2)
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)["result"]
+        regressions = compare(result, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Compara el cost de codificar/descodificar les lectures amb JSON i amb el format binari de shared.wire.
+
+Ús: python -m benchmarks.wire [--readings 100000] [--batch 100]
+"""
+import argparse
+import json
+import random
+import timeit
+
+from shared import wire
+
+
+def make_readings(n):
+    readings = []
+    for i in range(n):
+        data = {"velocity": None, "temperature": None, "humidity": None, "battery_level": round(random.random(), 2),
+                "last_seen": f"2020-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}.000Z"}
+        if i % 2:
+            data["velocity"] = random.uniform(0, 120)
+        else:
+            data["temperature"] = random.uniform(-10, 40)
+            data["humidity"] = random.uniform(0, 100)
+        readings.append((i % 1000, data))
+    return readings
+
+
+# Format anterior: ExamplePayload.to_json amb les claus ordenades i indentació
+def json_pretty(reading):
+    sensor_id, data = reading
+    return json.dumps({"type": "sensor_data", "payload": {"id": sensor_id, **data}}, sort_keys=True, indent=4).encode()
+
+def json_compact(reading):
+    sensor_id, data = reading
+    return json.dumps({"type": "sensor_data", "payload": {"id": sensor_id, **data}}, separators=(",", ":")).encode()
+
+
+def bench(name, encode, decode, items, repeat):
+    bodies = [encode(item) for item in items]
+    encode_time = min(timeit.repeat(lambda: [encode(item) for item in items], number=1, repeat=repeat))
+    decode_time = min(timeit.repeat(lambda: [decode(body) for body in bodies], number=1, repeat=repeat))
+    return name, encode_time, decode_time, sum(len(body) for body in bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings)
+    batches = [readings[i:i + args.batch] for i in range(0, len(readings), args.batch)]
+    results = [
+        bench("json (indent=4, sort_keys)", json_pretty, json.loads, readings, args.repeat),
+        bench("json (compact)", json_compact, json.loads, readings, args.repeat),
+        bench("binary (1 reading/message)", lambda r: wire.encode_readings([r]), wire.decode_readings, readings, args.repeat),
+        bench(f"binary ({args.batch} readings/message)", wire.encode_readings, wire.decode_readings, batches, args.repeat),
+    ]
+
+    print(f"{args.readings} readings")
+    print(f"{'format':<32}{'encode us/reading':>18}{'decode us/reading':>18}{'bytes/reading':>15}")
+    for name, encode_time, decode_time, size in results:
+        print(f"{name:<32}{encode_time / args.readings * 1e6:>18.2f}{decode_time / args.readings * 1e6:>18.2f}{size / args.readings:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
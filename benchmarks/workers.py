@@ -0,0 +1,79 @@
+"""Mesura com escala el throughput de l'API amb el nombre de workers de gunicorn.
+
+Per a cada nombre de workers arrenca gunicorn amb gunicorn.conf.py, espera /health/live i hi llança la mateixa càrrega
+que benchmarks.load, per defecte tan ràpid com pot (--rate alt). Necessita els serveis reals (BACKEND=live): amb els backends
+en memòria cada worker tindria les seves pròpies dades.
+
+    python -m benchmarks.workers --workers 1,2,4,8 --duration 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import load
+
+
+def wait_live(base_url, timeout=60):
+    import httpx
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health/live", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"API at {base_url} did not start in {timeout}s")
+
+
+def start_server(workers, port):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{port}")
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"], env=env)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput of the API by number of gunicorn workers")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--sensors", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=100000, help="target requests per second (default: as fast as possible)")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--mix", default=load.DEFAULT_MIX)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    import httpx
+    base_url = f"http://127.0.0.1:{args.port}"
+    weights = load.parse_mix(args.mix)
+    results = {}
+    for workers in [int(n) for n in args.workers.split(",")]:
+        server = start_server(workers, args.port)
+        try:
+            wait_live(base_url)
+            client = httpx.Client(base_url=base_url, timeout=30, limits=httpx.Limits(max_connections=args.concurrency))
+            fleet = load.Fleet(client, args.sensors, "Bench sensor")
+            print(f"\n{workers} workers")
+            results[workers] = load.run(client, fleet, weights, args.rate, args.duration, args.concurrency)
+            load.print_report(results[workers])
+            client.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+    base = next(iter(results.values()))["total"]["throughput"]
+    print(f"\n{'workers':>8}{'req/s':>10}{'speedup':>10}{'p95 ms':>10}")
+    for workers, result in results.items():
+        total = result["total"]
+        print(f"{workers:>8}{total['throughput']:>10.1f}{total['throughput'] / base:>10.2f}{total['p95_ms'] or 0:>10.2f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,191 @@
-import json
+import hashlib
+import time
 
-from shared.subscriber import Subscriber
+import pika
 
-subscriber = Subscriber()
+from shared import backends, metrics, wire
+from shared.publisher import retry_queue_name
+from shared.sensors import alerts, events, messages, repository, schemas
+from shared.sensors.keys import seen_key
+from shared.settings import settings
 
+subscriber = backends.subscriber(shards=settings.queue_shards, assigned_shards=settings.assigned_shards,
+                                 max_length=settings.queue_max_length, overflow=settings.queue_overflow,
+                                 retry_delay=settings.consumer_retry_delay, prefetch=settings.consumer_prefetch,
+                                 wait_timeout=settings.startup_timeout)
 
-def callback(ch, method, properties, body):
-    data = json.loads(body)
-    print("Received data:", data)
+# Clients que fan servir els handlers dels missatges
+clients = {
+    "redis": backends.redis_client(),
+    "mongodb": backends.mongodb_client(),
+    "elastic": backends.elasticsearch_client(),
+    "cassandra": backends.cassandra_client(),
+}
+timescale = backends.timescale()
+clients["timescale"] = timescale
+# Publicador dels avisos de bateria baixa. Declara les cues amb els mateixos arguments que l'API
+publisher = backends.publisher(shards=settings.queue_shards, buffer_size=settings.publisher_buffer_size,
+                               max_length=settings.queue_max_length, overflow=settings.queue_overflow)
 
+batch_sizes = metrics.registry.histogram("consumer_batch_messages", "Messages in each batch processed by the consumer", buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+batch_duration = metrics.registry.histogram("consumer_batch_duration_seconds", "Time to process a batch of messages")
+lag = metrics.registry.histogram("consumer_lag_seconds", "Time between publishing a message and processing it", buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+processed = metrics.registry.counter("consumer_messages_total", "Messages processed by the consumer, by outcome", ("outcome",))
+readings_written = metrics.registry.counter("consumer_readings_total", "Readings received by the consumer, by outcome", ("outcome",))
 
-subscriber.subscribe(callback)
+
+def parse(body, content_type):
+    # Descodifica el missatge i valida les lectures. Si falla, el missatge no es podrà processar mai (poison message)
+    parsed = []
+    for message_type, payload in wire.decode(body, content_type):
+        if message_type == messages.SENSOR_DATA:
+            sensor_id = payload.pop("id")
+            payload = (sensor_id, schemas.SensorData(**payload))
+        parsed.append((message_type, payload))
+    return parsed
+
+
+def digest(data):
+    return hashlib.blake2b(data.json().encode(), digest_size=8).hexdigest()
+
+
+def record_readings(readings, redelivered=()):
+    # Amb ack manual el broker pot tornar a entregar una lectura. La recordem una estona a Redis amb un resum del contingut,
+    # així descartem els duplicats però no una correcció amb el mateix last_seen. TimescaleDB ja és idempotent (ON CONFLICT)
+    redis = clients["redis"]
+    keys = [seen_key(sensor_id, data.last_seen) for sensor_id, data in readings]
+    digests = [digest(data) for _, data in readings]
+    seen = redis.mget(keys)
+    new_readings = [reading for reading, value, current in zip(readings, seen, digests) if value != current.encode()]
+    readings_written.inc(len(readings) - len(new_readings), outcome="duplicate")
+    if not new_readings:
+        return
+    changes = repository.record_data_batch(redis=redis, readings=new_readings, timescale=timescale, cassandra=clients["cassandra"],
+                                           redelivered=redelivered)
+    if settings.battery_alerts:
+        alerts.publish(publisher, changes)
+    readings_written.inc(len(new_readings), outcome="written")
+    pipe = redis.pipeline(transaction=False)
+    for key, current in zip(keys, digests):
+        pipe.set(key, current, ex=settings.dedup_ttl)
+    pipe.execute()
+
+
+def is_redelivery(method, properties):
+    # El broker el torna a entregar (no s'havia confirmat) o ve de la cua de reintents
+    return bool(method.redelivered or (properties.headers or {}).get("x-retries"))
+
+
+def handle(message_type, payload):
+    # Els esdeveniments de l'outbox es propaguen a la resta de bases de dades
+    if message_type in events.HANDLERS:
+        events.apply_event(message_type, payload, **clients)
+    else:
+        print("Received data:", payload)
+
+
+def retry_or_dead_letter(ch, method, properties, body):
+    # Torna a provar el missatge més tard a través de la cua de reintents del shard, fins a consumer_max_retries vegades.
+    # Després el rebutja i el broker l'envia a la cua de dead letters
+    headers = dict(properties.headers or {})
+    retries = headers.get("x-retries", 0)
+    if retries >= settings.consumer_max_retries:
+        processed.inc(outcome="dead_letter")
+        ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    processed.inc(outcome="retry")
+    headers["x-retries"] = retries + 1
+    ch.basic_publish(exchange='', routing_key=retry_queue_name(int(method.routing_key)), body=body,
+                     properties=pika.BasicProperties(content_type=properties.content_type, delivery_mode=2, headers=headers))
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def redelivered_readings(method, properties, readings):
+    # (id, last_seen) de les lectures d'un missatge que es torna a processar: no han de substituir una lectura més nova
+    if is_redelivery(method, properties):
+        return {(sensor_id, data.last_seen) for sensor_id, data in readings}
+    return set()
+
+
+def process_message(ch, method, properties, body, parsed):
+    # Processa un sol missatge: si falla, només aquest missatge gasta un reintent
+    try:
+        # Les lectures seguides s'escriuen juntes, i sempre abans de l'esdeveniment que les segueix
+        readings = []
+        for message_type, payload in parsed:
+            if message_type == messages.SENSOR_DATA:
+                readings.append(payload)
+                continue
+            if readings:
+                record_readings(readings, redelivered_readings(method, properties, readings))
+                readings = []
+            handle(message_type, payload)
+        if readings:
+            record_readings(readings, redelivered_readings(method, properties, readings))
+    except Exception as e:
+        print(f"Failed to process message, retrying later: {e!r}")
+        timescale.rollback()
+        retry_or_dead_letter(ch, method, properties, body)
+    else:
+        processed.inc(outcome="ack")
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def process(ch, deliveries):
+    # Escriu les lectures de tots els missatges del lot juntes, així a Redis i a la taula de bateria només s'escriu la més nova
+    # de cada sensor. Els esdeveniments de l'outbox s'apliquen en ordre: abans s'escriuen les lectures rebudes fins aquell moment
+    readings, pending, redelivered = [], [], set()
+    start = time.perf_counter()
+    batch_sizes.observe(len(deliveries))
+
+    def flush():
+        try:
+            if readings:
+                record_readings(readings, redelivered)
+        except Exception as e:
+            # No sabem quin missatge ha fallat: els tornem a escriure un per un, i només els que fallen sols gasten un reintent.
+            # Si no, una lectura que falla sempre faria gastar els reintents de les altres lectures del lot fins a la cua de dead letters
+            print(f"Failed to write {len(readings)} readings, writing each message on its own: {e!r}")
+            timescale.rollback()
+            for method, properties, body, parsed in pending:
+                process_message(ch, method, properties, body, parsed)
+        else:
+            for method, _, _, _ in pending:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+            processed.inc(len(pending), outcome="ack")
+        readings.clear()
+        pending.clear()
+        redelivered.clear()
+
+    for method, properties, body in deliveries:
+        published_at = (properties.headers or {}).get("x-published-at")
+        if published_at:
+            lag.observe(max(0, time.time() - published_at / 1000))
+        try:
+            parsed = parse(body, properties.content_type)
+        except Exception as e:
+            print(f"Dead-lettering malformed message: {e!r}")
+            processed.inc(outcome="malformed")
+            ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            continue
+        # Un missatge pot contenir moltes lectures empaquetades
+        if all(message_type == messages.SENSOR_DATA for message_type, _ in parsed):
+            message_readings = [payload for _, payload in parsed]
+            readings.extend(message_readings)
+            pending.append((method, properties, body, parsed))
+            redelivered.update(redelivered_readings(method, properties, message_readings))
+            continue
+        flush()
+        process_message(ch, method, properties, body, parsed)
+    flush()
+    batch_duration.observe(time.perf_counter() - start)
+
+
+def run():
+    subscriber.subscribe_batches(process, batch_size=settings.consumer_batch_size, window=settings.consumer_batch_window)
+
+
+# Amb BACKEND=memory el consumidor ha de córrer al mateix procés que l'API: es pot importar i cridar run() en un fil
+if __name__ == "__main__":
+    metrics.start_http_server(settings.consumer_metrics_port)
+    run()
@@ -0,0 +1,4 @@
+path= pwd
+export PYTHONPATH=$PYTHONPATH:$path
+echo $PYTHONPATH
+python -m shared.sensors.outbox
@@ -0,0 +1,44 @@
+# Configuració de gunicorn per executar l'API amb diversos workers de uvicorn:
+#     gunicorn -c gunicorn.conf.py app.main:app
+# Cada worker és un procés amb les seves connexions (vegeu shared/connections.py) i les seves mètriques, que escriu a
+# METRICS_DIR: /metrics suma les de tots els workers, també les dels que ja han acabat (vegeu shared/metrics.py)
+import multiprocessing
+import os
+import tempfile
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# L'app es carrega al procés principal abans del fork: els workers arrenquen més ràpid i comparteixen la memòria del codi
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+metrics_dir = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "senser-metrics"))
+
+
+def on_starting(server):
+    # Les mètriques d'una execució anterior no s'han de sumar a les d'aquesta
+    from shared import metrics
+    metrics.clear_multiprocess(metrics_dir)
+
+
+def post_fork(server, worker):
+    # El fill no pot fer servir els sockets heretats del pare: descartem les connexions i els pools de SQLAlchemy
+    # sense tancar-les (són compartides amb el procés principal) i cada worker en crea de noves quan les necessita
+    from shared import connections, database
+    connections.reset()
+    database.dispose(close=False)
+    from shared import metrics
+    metrics.start_multiprocess(metrics_dir)
+
+
+def worker_exit(server, worker):
+    from shared import metrics
+    metrics.stop_multiprocess()
+
+
+def child_exit(server, worker):
+    # Els gauges d'un worker que ha acabat ja no es sumen; els seus comptadors i histogrames sí
+    from shared import metrics
+    metrics.mark_process_dead(metrics_dir, worker.pid)
@@ -0,0 +1,5 @@
+-- 
+-- depends: 20230212_01_VKKLZ
+
+CREATE TABLE IF NOT EXISTS outbox ( id serial PRIMARY KEY, event_type varchar(64) NOT NULL, payload json NOT NULL, created_at timestamp NOT NULL DEFAULT now(), dispatched_at timestamp );
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (id) WHERE dispatched_at IS NULL;
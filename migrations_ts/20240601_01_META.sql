@@ -0,0 +1,10 @@
+-- 
+-- depends: migrations_ts
+
+-- Còpia del tipus i el nom de cada sensor per poder-los creuar amb sensor_data a les consultes d'analítica.
+-- La mantenen els esdeveniments de l'outbox (sensor_created i sensor_deleted)
+CREATE TABLE IF NOT EXISTS sensor_meta (
+    id integer PRIMARY KEY,
+    type text NOT NULL,
+    name text
+);
@@ -0,0 +1,58 @@
+from shared.settings import settings
+
+# Crea els clients de les bases de dades i de la cua segons settings.backend:
+# - "live": els clients reals, que es connecten als serveis del docker-compose
+# - "memory": les implementacions en memòria de shared/memory, per executar l'API i el consumidor sense contenidors.
+#   Els clients en memòria d'un mateix procés comparteixen les dades, com si es connectessin al mateix servidor
+
+def is_memory() -> bool:
+    return settings.backend == "memory"
+
+def redis_client():
+    if is_memory():
+        from shared.memory.redis_client import MemoryRedisClient
+        return MemoryRedisClient()
+    from shared.redis_client import RedisClient
+    return RedisClient(host="redis")
+
+def mongodb_client():
+    if is_memory():
+        from shared.memory.mongodb_client import MemoryMongoDBClient
+        return MemoryMongoDBClient()
+    from shared.mongodb_client import MongoDBClient
+    return MongoDBClient(host="mongodb")
+
+def elasticsearch_client():
+    if is_memory():
+        from shared.memory.elasticsearch_client import MemoryElasticsearchClient
+        return MemoryElasticsearchClient()
+    from shared.elasticsearch_client import ElasticsearchClient
+    return ElasticsearchClient(host="elasticsearch")
+
+def cassandra_client():
+    if is_memory():
+        from shared.memory.cassandra_client import MemoryCassandraClient
+        return MemoryCassandraClient()
+    from shared.cassandra_client import CassandraClient
+    return CassandraClient(hosts=["cassandra"])
+
+def timescale():
+    if is_memory():
+        from shared.memory.timescale import MemoryTimescale
+        return MemoryTimescale()
+    from shared.timescale import Timescale
+    return Timescale()
+
+def publisher(**kwargs):
+    if is_memory():
+        from shared.memory.broker import MemoryPublisher
+        return MemoryPublisher(**kwargs)
+    from shared.publisher import Publisher
+    return Publisher(**kwargs)
+
+def subscriber(**kwargs):
+    if is_memory():
+        from shared.memory.broker import MemorySubscriber
+        return MemorySubscriber(**kwargs)
+    from shared.subscriber import Subscriber
+    return Subscriber(**kwargs)
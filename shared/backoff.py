@@ -0,0 +1,18 @@
+import time
+
+def retry(operation, timeout=30, initial_delay=0.5, max_delay=5, exceptions=(Exception,), description="service"):
+    # Crida operation fins que no falli, esperant cada cop el doble (fins a max_delay) i com a molt timeout segons en total.
+    # Si el servei no respon a temps es torna a llançar l'últim error, en lloc d'esperar indefinidament
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            return operation()
+        except exceptions as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+            wait = min(delay, remaining)
+            print(f"Waiting for {description}, retrying in {wait:.1f}s: {e!r}")
+            time.sleep(wait)
+            delay = min(delay * 2, max_delay)
@@ -1,20 +1,67 @@
+import threading
+import time
+
 from cassandra.cluster import Cluster
+from shared import connections, metrics
+from shared.settings import settings
 
 class CassandraClient:
+    # El Cluster i la sessió del driver són thread-safe però no fork-safe: en fem servir un per procés, com els altres clients.
+    # El keyspace i les taules els crea app.migrate a partir de migrations_cassandra.
+    # Les escriptures es poden enviar amb execute_async sense esperar cada resposta. Un semàfor del procés limita les consultes
+    # pendents a cassandra_max_in_flight: quan s'arriba al límit, execute_async espera que n'acabi alguna
     def __init__(self, hosts):
-        self.cluster = Cluster(hosts,protocol_version=4)
-        self.session = self.cluster.connect()
-        # Crea el keyspace "sensor" si ºno existeix
-        self.session.execute("CREATE KEYSPACE IF NOT EXISTS sensor WITH REPLICATION = { 'class': 'SimpleStrategy', 'replication_factor': 1};")
-        # Crea les taules per a les dades de temperatura, quantitat de sensors de cada tipus i bateria si no existeixen
-        self.session.execute("CREATE TABLE IF NOT EXISTS sensor.temperature(id INT, temperature FLOAT, PRIMARY KEY(id, temperature));")
-        self.session.execute("CREATE TABLE IF NOT EXISTS sensor.quantity(id INT, type text, PRIMARY KEY(type, id));")
-        self.session.execute("CREATE TABLE IF NOT EXISTS sensor.battery(id INT, battery_level FLOAT, PRIMARY KEY(battery_level, id));")
+        self.hosts = hosts
+        self.cluster, self.session, self._in_flight = connections.per_process(("cassandra", tuple(hosts)), self._connect)
+
+    def _connect(self):
+        cluster = Cluster(self.hosts,protocol_version=4)
+        return cluster, cluster.connect(), threading.BoundedSemaphore(settings.cassandra_max_in_flight)
+
     def get_session(self):
         return self.session
 
     def close(self):
-        self.cluster.shutdown()
+        # La sessió és del procés: no es tanca en acabar cada petició
+        pass
 
+    def ping(self):
+        return self.get_session().execute("SELECT release_version FROM system.local").one() is not None
+
+    @metrics.timed("cassandra")
     def execute(self, query):
-        return self.get_session().execute(query)
\ No newline at end of file
+        return self.get_session().execute(query)
+
+    def execute_async(self, query):
+        # Retorna el ResponseFuture del driver. Els callbacks alliberen la plaça i registren la latència i els errors
+        self._in_flight.acquire()
+        start = time.perf_counter()
+
+        def done(_):
+            self._in_flight.release()
+            metrics.store_duration.observe(time.perf_counter() - start, store="cassandra", operation="execute_async")
+
+        def failed(_):
+            done(None)
+            metrics.store_errors.inc(store="cassandra", operation="execute_async")
+
+        try:
+            future = self.get_session().execute_async(query)
+        except Exception:
+            failed(None)
+            raise
+        future.add_callbacks(done, failed)
+        return future
+
+    def execute_concurrent(self, queries):
+        # Envia totes les consultes alhora i espera que acabin totes: una sola espera en lloc d'una anada i tornada per consulta.
+        # Si alguna falla, llança la primera excepció un cop han acabat les altres
+        futures = [self.execute_async(query) for query in queries]
+        error = None
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
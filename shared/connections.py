@@ -0,0 +1,35 @@
+import os
+import threading
+
+# Connexions compartides per tots els fils d'un procés. Es guarden amb el pid del procés que les ha creat: després d'un fork
+# (per exemple, els workers de gunicorn) el procés fill no reutilitza mai els sockets del pare i en crea de nous
+
+_lock = threading.Lock()
+_connections = {}
+
+def per_process(key, factory):
+    pid = os.getpid()
+    with _lock:
+        entry = _connections.get(key)
+        if entry is None or entry[0] != pid:
+            entry = _connections[key] = (pid, factory())
+        return entry[1]
+
+def discard(key):
+    # Treu la connexió del registre i la retorna perquè es pugui tancar (None si no n'hi ha cap d'aquest procés)
+    with _lock:
+        entry = _connections.pop(key, None)
+    return entry[1] if entry is not None and entry[0] == os.getpid() else None
+
+def reset():
+    # Oblida les connexions heretades del procés pare sense tancar-les: els sockets són compartits amb el pare
+    with _lock:
+        _connections.clear()
+
+def _after_fork():
+    # Si un altre fil tenia el bloqueig en el moment del fork, al fill quedaria bloquejat per sempre
+    global _lock
+    _lock = threading.Lock()
+    _connections.clear()
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -1,28 +1,18 @@
 from elasticsearch import Elasticsearch
-import time
+from shared import connections, metrics
 
 class ElasticsearchClient:
     def __init__(self, host="localhost", port="9200"):
         self.host = host
         self.port = port
-        self.client = Elasticsearch(["http://"+self.host+":"+self.port])
-        while not self.ping():
-            print("Waiting for Elasticsearch to start...")
-            time.sleep(1)
-        if not self.client.indices.exists(index="sensors"):
-            # Create the index
-            self.create_index(index_name="sensors")
-            # Define the mapping for the index
-            mapping = {
-                "properties": {
-                    "name": {"type": "keyword"},
-                    "type": {"type": "keyword"},
-                    "description": {"type": "text"}
-                }
-            }
-            self.create_mapping(index_name="sensors", mapping=mapping)
+        # El client d'Elasticsearch és thread-safe i té el seu pool de connexions: en compartim un per procés
+        self.client = connections.per_process(("elasticsearch", host, port), lambda: Elasticsearch(["http://"+self.host+":"+self.port]))
+        # Crear el client no fa cap petició: app.migrate espera que Elasticsearch respongui i les comprovacions de /health/ready hi fan ping.
+        # L'índex de sensors i el seu mapping els crea app.migrate a partir de migrations_es
+
     def ping(self):
         return self.client.ping()
+
     
     def clearIndex(self, index_name):
         if self.client.indices.exists(index=index_name):
@@ -33,7 +23,11 @@ class ElasticsearchClient:
             return None
     
     def close(self):
-        self.client.close()
+        # Les connexions són del pool del procés: no es tanquen en acabar cada petició
+        pass
+
+    def index_exists(self, index_name):
+        return bool(self.client.indices.exists(index=index_name))
 
     def create_index(self, index_name):
         return self.client.indices.create(index=index_name)
@@ -41,11 +35,13 @@ class ElasticsearchClient:
     def create_mapping(self, index_name, mapping):
         return self.client.indices.put_mapping(index=index_name, body=mapping)
     
+    @metrics.timed("elasticsearch")
     def search(self, index_name, query):
         return self.client.search(index=index_name, body=query)
     
-    def index_document(self, index_name, document):
-        return self.client.index(index=index_name, body=document)
+    @metrics.timed("elasticsearch")
+    def index_document(self, index_name, document, id=None):
+        return self.client.index(index=index_name, body=document, id=id)
     
 
     
@@ -0,0 +1,3 @@
+# Implementacions en memòria dels clients de shared/ (Redis, MongoDB, Elasticsearch, Cassandra, TimescaleDB i RabbitMQ).
+# Tenen la mateixa interfície que els clients reals i es fan servir amb BACKEND=memory (vegeu shared/backends.py),
+# per executar l'API, el consumidor, els tests i els benchmarks sense cap contenidor. L'estat és del procés.
@@ -0,0 +1,182 @@
+import collections
+import itertools
+import threading
+import time
+import types
+
+from shared.publisher import ALERTS_EXCHANGE, ALERTS_QUEUE, DEAD_LETTER_QUEUE, EXCHANGE_NAME, queue_name, retry_queue_name, shard_for
+
+# RabbitMQ en memòria: les mateixes cues per shard, amb ack manual, reintents amb retard i cua de dead letters.
+# El publicador i el consumidor han de ser al mateix procés (per exemple, el consumidor en un fil dels tests o benchmarks)
+
+class MemoryBroker:
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+        self.unacked = {}
+        self.delayed = []
+        self._tags = itertools.count(1)
+        self._changed = threading.Condition()
+
+    def put(self, queue, routing_key, body, properties):
+        with self._changed:
+            self.queues[queue].append((routing_key, body, properties))
+            self._changed.notify_all()
+
+    def put_delayed(self, delay, queue, routing_key, body, properties):
+        with self._changed:
+            self.delayed.append((time.monotonic() + delay, queue, routing_key, body, properties))
+            self._changed.notify_all()
+
+    def _release_delayed(self):
+        now = time.monotonic()
+        for item in [item for item in self.delayed if item[0] <= now]:
+            self.delayed.remove(item)
+            self.queues[item[1]].append(item[2:])
+
+    def get(self, queues, limit, timeout):
+        # Treu fins a limit missatges de les cues, esperant com a molt timeout segons que n'arribi algun
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                self._release_delayed()
+                deliveries = []
+                for queue in queues:
+                    while self.queues[queue] and len(deliveries) < limit:
+                        routing_key, body, properties = self.queues[queue].popleft()
+                        tag = next(self._tags)
+                        self.unacked[tag] = (queue, routing_key, body, properties)
+                        method = types.SimpleNamespace(delivery_tag=tag, routing_key=routing_key, exchange=EXCHANGE_NAME, redelivered=False)
+                        deliveries.append((method, properties, body))
+                remaining = deadline - time.monotonic()
+                if deliveries or remaining <= 0:
+                    return deliveries
+                self._changed.wait(min(remaining, 0.05) if self.delayed else remaining)
+
+    def ack(self, tag):
+        with self._changed:
+            self.unacked.pop(tag, None)
+
+    def reject(self, tag, requeue):
+        with self._changed:
+            queue, routing_key, body, properties = self.unacked.pop(tag)
+            if requeue:
+                self.queues[queue].appendleft((routing_key, body, properties))
+            else:
+                self.queues[DEAD_LETTER_QUEUE].append((routing_key, body, properties))
+            self._changed.notify_all()
+
+    def depth(self, queue):
+        return len(self.queues[queue])
+
+broker = MemoryBroker()
+
+class MemoryChannel:
+    # Les operacions del canal de pika que fa servir el consumidor
+    def __init__(self, broker, shards, retry_delay):
+        self.broker = broker
+        self.shards = shards
+        self.retry_delay = retry_delay
+
+    def basic_ack(self, delivery_tag):
+        self.broker.ack(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.broker.reject(delivery_tag, requeue)
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.broker.reject(delivery_tag, requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        # Les cues de reintents retornen el missatge a la cua del seu shard després de retry_delay ms
+        for shard in range(self.shards):
+            if exchange == '' and routing_key == retry_queue_name(shard):
+                return self.broker.put_delayed(self.retry_delay / 1000, queue_name(shard), str(shard), body, properties)
+        queue = queue_name(int(routing_key)) if exchange == EXCHANGE_NAME else routing_key
+        self.broker.put(queue, routing_key, body, properties)
+
+class MemoryPublisher:
+    def __init__(self, host='rabbitmq', port=5672, shards=4, buffer_size=10000, max_length=None, overflow="reject-publish",
+                 high_watermark=0.8, **_):
+        self.broker = broker
+        self.shards = shards
+        self.max_length = max_length
+        self.overflow = overflow
+        self.high_watermark = high_watermark
+        # Shards que han rebutjat l'últim missatge
+        self.rejected = set()
+        self._buffer_size = buffer_size
+
+    def publish(self, message, coalesce=False) -> bool:
+        properties = types.SimpleNamespace(content_type=message.content_type, delivery_mode=2,
+                                           headers={"x-published-at": int(time.time() * 1000)})
+        exchange = getattr(message, "exchange", EXCHANGE_NAME)
+        if exchange != EXCHANGE_NAME:
+            # Els avisos van a la cua lligada a l'exchange fanout; amb l'exchange per defecte, a la cua que indica la routing key
+            routing_key = getattr(message, "routing_key", "")
+            self.broker.put(ALERTS_QUEUE if exchange == ALERTS_EXCHANGE else routing_key, routing_key, message.to_bytes(), properties)
+            return True
+        # Com el broker amb x-overflow reject-publish, una cua plena rebutja els missatges nous
+        shard = shard_for(message.sensor_id, self.shards)
+        if self.max_length and self.overflow == "reject-publish" and self.broker.depth(queue_name(shard)) >= self.max_length:
+            self.rejected.add(shard)
+            return False
+        self.rejected.discard(shard)
+        self.broker.put(queue_name(shard), str(shard), message.to_bytes(), properties)
+        return True
+
+    def buffered(self) -> int:
+        return 0
+
+    def overloaded(self, sensor_id=None) -> bool:
+        shards = range(self.shards) if sensor_id is None else [shard_for(sensor_id, self.shards)]
+        return bool(self.max_length) and any(self.broker.depth(queue_name(shard)) >= self.high_watermark * self.max_length
+                                             for shard in shards)
+
+    def status(self) -> dict:
+        return {
+            "connected": True,
+            "blocked": False,
+            "rejected": sorted(queue_name(shard) for shard in self.rejected),
+            "overloaded": self.overloaded(),
+            "buffered": 0,
+            "buffer_size": self._buffer_size,
+            "coalesced": 0,
+            "queues": {queue_name(shard): {"messages": self.broker.depth(queue_name(shard)), "consumers": 0} for shard in range(self.shards)},
+        }
+
+    def flush(self, timeout=None) -> bool:
+        return True
+
+    def close(self, timeout=10):
+        pass
+
+class MemorySubscriber:
+    def __init__(self, host='localhost', shards=4, assigned_shards=None, retry_delay=5000, prefetch=500, **_):
+        self.broker = broker
+        self.shards = shards
+        self.prefetch = prefetch
+        self.assigned_shards = list(range(shards)) if assigned_shards is None else assigned_shards
+        self.channel = MemoryChannel(broker, shards, retry_delay)
+        self._closing = threading.Event()
+
+    def _queues(self):
+        return [queue_name(shard) for shard in self.assigned_shards]
+
+    def subscribe(self, callback):
+        while not self._closing.is_set():
+            for method, properties, body in self.broker.get(self._queues(), 1, timeout=0.1):
+                callback(self.channel, method, properties, body)
+
+    def subscribe_batches(self, callback, batch_size=500, window=0.2):
+        # Acumula missatges durant window segons (o fins a batch_size), com Subscriber.subscribe_batches
+        limit = min(batch_size, self.prefetch)
+        while not self._closing.is_set():
+            deliveries = []
+            deadline = time.monotonic() + window
+            while len(deliveries) < limit and time.monotonic() < deadline:
+                deliveries += self.broker.get(self._queues(), limit - len(deliveries), timeout=deadline - time.monotonic())
+            if deliveries:
+                callback(self.channel, deliveries)
+
+    def close(self):
+        self._closing.set()
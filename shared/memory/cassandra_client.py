@@ -0,0 +1,340 @@
+import collections
+import re
+import struct
+import threading
+import time
+
+from shared import metrics
+
+# Cassandra en memòria. Entén el subconjunt de CQL que fa servir l'aplicació: CREATE/DROP KEYSPACE, CREATE TABLE, TRUNCATE,
+# INSERT, DELETE i SELECT amb WHERE (=, <, <=, >, >=, IN), agregats (COUNT, MIN, MAX, AVG, SUM), GROUP BY, LIMIT i ALLOW FILTERING.
+# Les files es retornen com a namedtuples, igual que el row factory per defecte del driver
+
+class InvalidRequest(Exception):
+    pass
+
+_IDENTIFIER = r"[A-Za-z_][\w]*"
+_TABLE = rf"({_IDENTIFIER})\.({_IDENTIFIER})"
+_LITERAL = re.compile(r"\s*('(?:[^']|'')*'|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null)\s*", re.IGNORECASE)
+_CONDITION = re.compile(rf"\s*({_IDENTIFIER})\s*(<=|>=|=|<|>|IN)\s*", re.IGNORECASE)
+_SELECTOR = re.compile(rf"^(?:(count|min|max|avg|sum)\s*\(\s*(\*|{_IDENTIFIER})\s*\)|({_IDENTIFIER}))(?:\s+AS\s+({_IDENTIFIER}))?$", re.IGNORECASE)
+
+_STATEMENTS = [
+    ("create_keyspace", re.compile(rf"^CREATE\s+KEYSPACE\s+(IF\s+NOT\s+EXISTS\s+)?({_IDENTIFIER})\b.*$", re.IGNORECASE | re.DOTALL)),
+    ("drop_keyspace", re.compile(rf"^DROP\s+KEYSPACE\s+(IF\s+EXISTS\s+)?({_IDENTIFIER})$", re.IGNORECASE)),
+    ("create_table", re.compile(rf"^CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?{_TABLE}\s*\((.*)\)$", re.IGNORECASE | re.DOTALL)),
+    ("drop_table", re.compile(rf"^DROP\s+TABLE\s+(IF\s+EXISTS\s+)?{_TABLE}$", re.IGNORECASE)),
+    ("truncate", re.compile(rf"^TRUNCATE\s+(?:TABLE\s+)?{_TABLE}$", re.IGNORECASE)),
+    ("insert", re.compile(rf"^INSERT\s+INTO\s+{_TABLE}\s*\(([^)]*)\)\s*VALUES\s*\((.*)\)(\s+IF\s+NOT\s+EXISTS)?$", re.IGNORECASE | re.DOTALL)),
+    ("delete", re.compile(rf"^DELETE\s+FROM\s+{_TABLE}\s+WHERE\s+(.*)$", re.IGNORECASE | re.DOTALL)),
+    ("select", re.compile(rf"^SELECT\s+(.*?)\s+FROM\s+{_TABLE}(?:\s+WHERE\s+(.*?))?(?:\s+GROUP\s+BY\s+(.*?))?(?:\s+LIMIT\s+(\d+))?(\s+ALLOW\s+FILTERING)?$", re.IGNORECASE | re.DOTALL)),
+]
+
+def _literal(text):
+    text = text.strip()
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    lowered = text.lower()
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    if lowered == "null":
+        return None
+    return float(text) if re.search(r"[.eE]", text) else int(text)
+
+def _literals(text):
+    values, position = [], 0
+    while position < len(text):
+        match = _LITERAL.match(text, position)
+        if not match:
+            raise InvalidRequest(f"Cannot parse values: {text}")
+        values.append(_literal(match.group(1)))
+        position = match.end()
+        if position < len(text):
+            if text[position] != ",":
+                raise InvalidRequest(f"Cannot parse values: {text}")
+            position += 1
+    return values
+
+def _conditions(text):
+    # "a = 1 AND b IN (1, 2)" -> [("a", "=", 1), ("b", "IN", [1, 2])]
+    conditions = []
+    for part in re.split(r"\s+AND\s+", text.strip(), flags=re.IGNORECASE):
+        match = _CONDITION.match(part)
+        if not match:
+            raise InvalidRequest(f"Cannot parse condition: {part}")
+        column, operator, rest = match.group(1).lower(), match.group(2).upper(), part[match.end():].strip()
+        value = _literals(rest.strip("()")) if operator == "IN" else _literal(rest)
+        conditions.append((column, operator, value))
+    return conditions
+
+def _matches(row, conditions):
+    for column, operator, value in conditions:
+        current = row.get(column)
+        if operator == "IN":
+            if current not in value:
+                return False
+        elif current is None:
+            return False
+        elif not {"=": current == value, "<": current < value, "<=": current <= value,
+                  ">": current > value, ">=": current >= value}[operator]:
+            return False
+    return True
+
+def _float32(value):
+    # Les columnes FLOAT de Cassandra són de 32 bits
+    return None if value is None else struct.unpack("f", struct.pack("f", value))[0]
+
+def _aggregate(function, values):
+    values = [value for value in values if value is not None]
+    if function == "count":
+        return len(values)
+    if function == "min":
+        return min(values, default=None)
+    if function == "max":
+        return max(values, default=None)
+    if function == "sum":
+        return sum(values)
+    if function == "avg":
+        return sum(values) / len(values) if values else 0
+
+class MemoryTable:
+    def __init__(self, columns, partition_key, clustering_key):
+        self.columns = columns
+        self.partition_key = partition_key
+        self.clustering_key = clustering_key
+        self.primary_key = partition_key + clustering_key
+        self.rows = {}
+
+    @classmethod
+    def parse(cls, definition):
+        # "id INT, temperature FLOAT, PRIMARY KEY((id), temperature)"
+        columns = {}
+        primary_columns = []
+        primary = re.search(r"PRIMARY\s+KEY\s*\((.*)\)\s*$", definition, re.IGNORECASE | re.DOTALL)
+        body = definition[:primary.start()] if primary else definition
+        for column in filter(None, (part.strip() for part in body.split(","))):
+            name, kind, *rest = column.split()
+            columns[name.lower()] = kind.lower()
+            if rest and " ".join(rest).upper() == "PRIMARY KEY":
+                primary_columns = [name.lower()]
+        if primary:
+            key = primary.group(1).strip()
+            if key.startswith("("):
+                partition_text, _, clustering_text = key[1:].partition(")")
+                partition_key = [column.strip().lower() for column in partition_text.split(",")]
+                clustering_key = [column.strip().lower() for column in clustering_text.split(",") if column.strip()]
+            else:
+                key_columns = [column.strip().lower() for column in key.split(",")]
+                partition_key, clustering_key = key_columns[:1], key_columns[1:]
+        else:
+            partition_key, clustering_key = primary_columns, []
+        return cls(columns, partition_key, clustering_key)
+
+    def coerce(self, column, value):
+        if column not in self.columns:
+            raise InvalidRequest(f"Undefined column name {column}")
+        kind = self.columns[column]
+        if value is None:
+            return None
+        if kind == "float":
+            return _float32(float(value))
+        if kind == "double":
+            return float(value)
+        if kind in ("int", "bigint", "smallint", "tinyint", "varint", "counter"):
+            return int(value)
+        return value
+
+    def ordered(self):
+        # Ordre de les files: per clau de partició i, dins de cada partició, per clau de clustering
+        return [self.rows[key] for key in sorted(self.rows, key=lambda key: tuple((value is None, value) for value in key))]
+
+class MemorySession:
+    def __init__(self):
+        self.keyspaces = {}
+        self._lock = threading.RLock()
+
+    def _table(self, keyspace, table):
+        if keyspace.lower() not in self.keyspaces:
+            raise InvalidRequest(f"Keyspace {keyspace} does not exist")
+        tables = self.keyspaces[keyspace.lower()]
+        if table.lower() not in tables:
+            raise InvalidRequest(f"unconfigured table {table}")
+        return tables[table.lower()]
+
+    def execute(self, query, parameters=None):
+        statement = query.strip().rstrip(";").strip()
+        for kind, pattern in _STATEMENTS:
+            match = pattern.match(statement)
+            if match:
+                with self._lock:
+                    return getattr(self, "_" + kind)(*match.groups())
+        raise InvalidRequest(f"Unsupported statement: {statement}")
+
+    def _create_keyspace(self, if_not_exists, keyspace):
+        if keyspace.lower() in self.keyspaces and not if_not_exists:
+            raise InvalidRequest(f"Keyspace {keyspace} already exists")
+        self.keyspaces.setdefault(keyspace.lower(), {})
+        return []
+
+    def _drop_keyspace(self, if_exists, keyspace):
+        if keyspace.lower() not in self.keyspaces and not if_exists:
+            raise InvalidRequest(f"Keyspace {keyspace} does not exist")
+        self.keyspaces.pop(keyspace.lower(), None)
+        return []
+
+    def _create_table(self, if_not_exists, keyspace, table, definition):
+        if keyspace.lower() not in self.keyspaces:
+            raise InvalidRequest(f"Keyspace {keyspace} does not exist")
+        tables = self.keyspaces[keyspace.lower()]
+        if table.lower() in tables and not if_not_exists:
+            raise InvalidRequest(f"Table {keyspace}.{table} already exists")
+        tables.setdefault(table.lower(), MemoryTable.parse(definition))
+        return []
+
+    def _drop_table(self, if_exists, keyspace, table):
+        tables = self.keyspaces.get(keyspace.lower(), {})
+        if table.lower() not in tables and not if_exists:
+            raise InvalidRequest(f"unconfigured table {table}")
+        tables.pop(table.lower(), None)
+        return []
+
+    def _truncate(self, keyspace, table):
+        self._table(keyspace, table).rows.clear()
+        return []
+
+    def _insert(self, keyspace, table, columns, values, if_not_exists):
+        table = self._table(keyspace, table)
+        columns = [column.strip().lower() for column in columns.split(",")]
+        values = _literals(values)
+        if len(columns) != len(values):
+            raise InvalidRequest("Unmatched column names/values")
+        row = {column: table.coerce(column, value) for column, value in zip(columns, values)}
+        missing = [column for column in table.primary_key if row.get(column) is None]
+        if missing:
+            raise InvalidRequest(f"Some primary key parts are missing: {', '.join(missing)}")
+        key = tuple(row[column] for column in table.primary_key)
+        # Un INSERT és un upsert: substitueix les columnes de la fila amb la mateixa clau primària
+        if key in table.rows and if_not_exists:
+            return []
+        table.rows.setdefault(key, {column: None for column in table.columns}).update(row)
+        return []
+
+    def _delete(self, keyspace, table, where):
+        table = self._table(keyspace, table)
+        conditions = [(column, operator, table.coerce(column, value) if operator != "IN" else [table.coerce(column, item) for item in value])
+                      for column, operator, value in _conditions(where)]
+        for key in [key for key, row in table.rows.items() if _matches(row, conditions)]:
+            del table.rows[key]
+        return []
+
+    def _select(self, selectors, keyspace, table, where, group_by, limit, allow_filtering):
+        table = self._table(keyspace, table)
+        conditions = []
+        if where:
+            for column, operator, value in _conditions(where):
+                value = [table.coerce(column, item) for item in value] if operator == "IN" else table.coerce(column, value)
+                conditions.append((column, operator, value))
+            # Sense ALLOW FILTERING cal fixar tota la clau de partició i només es pot filtrar per la clau primària
+            restricted = {column for column, operator, _ in conditions if operator in ("=", "IN")}
+            if not allow_filtering and (not set(table.partition_key) <= restricted
+                                        or any(column not in table.primary_key for column, _, _ in conditions)):
+                raise InvalidRequest("Cannot execute this query as it might involve data filtering and thus may have unpredictable performance. "
+                                     "If you want to execute this query despite the performance unpredictability, use ALLOW FILTERING")
+        rows = [row for row in table.ordered() if _matches(row, conditions)]
+
+        if selectors.strip() == "*":
+            output = [(column, None, column) for column in table.columns]
+        else:
+            output = []
+            for selector in selectors.split(","):
+                match = _SELECTOR.match(selector.strip())
+                if not match:
+                    raise InvalidRequest(f"Cannot parse selector: {selector}")
+                function, argument, column, alias = match.groups()
+                if function:
+                    function = function.lower()
+                    default = "count" if function == "count" else f"system_{function}_{argument.lower()}"
+                    output.append(((alias or default).lower(), function, argument.lower()))
+                else:
+                    output.append(((alias or column).lower(), None, column.lower()))
+        Row = collections.namedtuple("Row", [name for name, _, _ in output])
+
+        aggregated = any(function for _, function, _ in output)
+        if group_by:
+            group_columns = [column.strip().lower() for column in group_by.split(",")]
+            groups = collections.OrderedDict()
+            for row in rows:
+                groups.setdefault(tuple(row[column] for column in group_columns), []).append(row)
+            groups = list(groups.values())
+        elif aggregated:
+            groups = [rows]
+        else:
+            groups = [[row] for row in rows]
+
+        result = []
+        for group in groups:
+            values = []
+            for _, function, column in output:
+                if function:
+                    value = _aggregate(function, [1 if column == "*" else row[column] for row in group])
+                    # Els agregats sobre una columna FLOAT també són de 32 bits
+                    values.append(_float32(value) if value is not None and table.columns.get(column) == "float" else value)
+                else:
+                    values.append(group[0][column] if group else None)
+            result.append(Row(*values))
+        return result[:int(limit)] if limit else result
+
+class MemoryResponseFuture:
+    # Resultat d'execute_async: la consulta ja s'ha executat, però s'hi accedeix com al ResponseFuture del driver
+    def __init__(self, session, query):
+        self._rows, self._error = None, None
+        try:
+            self._rows = session.execute(query)
+        except Exception as e:
+            self._error = e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._rows
+
+    def add_callbacks(self, callback, errback):
+        if self._error is not None:
+            errback(self._error)
+        else:
+            callback(self._rows)
+
+class MemoryCassandraClient:
+    # La sessió és compartida per tots els clients del procés, com si es connectessin al mateix clúster
+    session = MemorySession()
+
+    def __init__(self, hosts=None):
+        # Com amb el client real, el keyspace i les taules els crea app.migrate
+        pass
+
+    def get_session(self):
+        return self.session
+
+    def close(self):
+        pass
+
+    def ping(self):
+        return True
+
+    @metrics.timed("cassandra")
+    def execute(self, query):
+        return self.get_session().execute(query)
+
+    def execute_async(self, query):
+        # Com el client real, registra la latència i els errors amb l'operació execute_async
+        start = time.perf_counter()
+        future = MemoryResponseFuture(self.get_session(), query)
+        metrics.store_duration.observe(time.perf_counter() - start, store="cassandra", operation="execute_async")
+        if future._error is not None:
+            metrics.store_errors.inc(store="cassandra", operation="execute_async")
+        return future
+
+    def execute_concurrent(self, queries):
+        futures = [self.execute_async(query) for query in queries]
+        for future in futures:
+            future.result()
@@ -0,0 +1,134 @@
+import copy
+import re
+import threading
+
+from shared import metrics
+
+# Elasticsearch en memòria amb les consultes que fa servir la cerca de sensors: match, term, fuzzy, prefix i match_all.
+# Els camps keyword es comparen sencers i els de text per paraules en minúscules, com l'analitzador estàndard
+
+def _tokens(value) -> list:
+    return re.findall(r"\w+", str(value).lower())
+
+def _edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def _fuzziness(term: str, fuzziness="AUTO") -> int:
+    if fuzziness != "AUTO":
+        return int(fuzziness)
+    return 0 if len(term) <= 2 else 1 if len(term) <= 5 else 2
+
+def _field_query(condition, key="value"):
+    # {"camp": "valor"} o {"camp": {"value"/"query": "valor", ...}}
+    for field, value in condition.items():
+        if isinstance(value, dict):
+            return field, value.get(key, value.get("query", value.get("value"))), value
+        return field, value, {}
+    raise ValueError("Empty query")
+
+class MemoryIndex:
+    def __init__(self):
+        self.mapping = {}
+        self.documents = {}
+        self._next_id = 0
+
+    def _is_keyword(self, field):
+        return self.mapping.get(field, {}).get("type") == "keyword"
+
+    def _terms(self, document, field):
+        value = document.get(field)
+        if value is None:
+            return []
+        return [str(value)] if self._is_keyword(field) else _tokens(value)
+
+    def score(self, document, query) -> float:
+        # Puntuació d'un document (0 si no coincideix)
+        (kind, condition), = query.items()
+        if kind == "match_all":
+            return 1.0
+        if kind == "bool":
+            must = [self.score(document, sub) for sub in condition.get("must", [])]
+            should = [self.score(document, sub) for sub in condition.get("should", [])]
+            if any(score == 0 for score in must) or (should and not must and not any(should)):
+                return 0.0
+            return sum(must) + sum(should) or 1.0
+        field, value, options = _field_query(condition, "query" if kind == "match" else "value")
+        terms = self._terms(document, field)
+        if kind == "match":
+            query_terms = [str(value)] if self._is_keyword(field) else _tokens(value)
+            return float(sum(1 for term in query_terms if term in terms))
+        if kind == "term":
+            return 1.0 if str(value) in terms else 0.0
+        if kind == "prefix":
+            return 1.0 if any(term.startswith(str(value)) for term in terms) else 0.0
+        if kind == "fuzzy":
+            value = str(value)
+            max_edits = _fuzziness(value, options.get("fuzziness", "AUTO"))
+            distances = [_edit_distance(value, term) for term in terms]
+            best = min(distances, default=max_edits + 1)
+            return 1.0 / (1 + best) if best <= max_edits else 0.0
+        raise ValueError(f"Unsupported query type: {kind}")
+
+class MemoryElasticsearchClient:
+    # Els índexs són compartits per tots els clients del procés
+    indices = {}
+    _lock = threading.RLock()
+
+    def __init__(self, host="localhost", port="9200"):
+        self.host = host
+        self.port = port
+
+    def ping(self):
+        return True
+
+    def clearIndex(self, index_name):
+        with self._lock:
+            return self.indices.pop(index_name, None) and {"acknowledged": True}
+
+    def close(self):
+        pass
+
+    def index_exists(self, index_name):
+        return index_name in self.indices
+
+    def create_index(self, index_name):
+        with self._lock:
+            self.indices.setdefault(index_name, MemoryIndex())
+            return {"acknowledged": True, "index": index_name}
+
+    def create_mapping(self, index_name, mapping):
+        with self._lock:
+            self.indices[index_name].mapping.update(mapping["properties"])
+            return {"acknowledged": True}
+
+    @metrics.timed("elasticsearch")
+    def search(self, index_name, query):
+        with self._lock:
+            index = self.indices.get(index_name, MemoryIndex())
+            scored = [(index.score(document, query.get("query", {"match_all": {}})), doc_id, document)
+                      for doc_id, document in index.documents.items()]
+        # Com Elasticsearch, ordenem per puntuació i per defecte retornem 10 resultats
+        hits = sorted((hit for hit in scored if hit[0] > 0), key=lambda hit: -hit[0])
+        return {"hits": {
+            "total": {"value": len(hits), "relation": "eq"},
+            "hits": [{"_index": index_name, "_id": doc_id, "_score": score, "_source": copy.deepcopy(document)}
+                     for score, doc_id, document in hits[:query.get("size", 10)]],
+        }}
+
+    @metrics.timed("elasticsearch")
+    def index_document(self, index_name, document, id=None):
+        with self._lock:
+            # Com Elasticsearch, un índex que no existeix es crea en indexar el primer document
+            index = self.indices.setdefault(index_name, MemoryIndex())
+            if id is None:
+                index._next_id += 1
+                id = f"memory-{index._next_id}"
+            result = "updated" if str(id) in index.documents else "created"
+            index.documents[str(id)] = copy.deepcopy(document)
+            return {"_index": index_name, "_id": str(id), "result": result}
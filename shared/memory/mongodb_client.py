@@ -0,0 +1,219 @@
+import copy
+import math
+import threading
+
+from shared import metrics
+
+# MongoDB en memòria amb els operadors de consulta que fa servir l'aplicació, inclosos els geoespacials ($near i $geoWithin)
+
+EARTH_RADIUS = 6378100.0
+
+def _get_path(document, path):
+    for part in path.split("."):
+        if not isinstance(document, dict) or part not in document:
+            return None
+        document = document[part]
+    return document
+
+def _point(value):
+    # Accepta un punt GeoJSON o un parell [longitud, latitud]
+    if isinstance(value, dict):
+        value = value.get("$geometry", value).get("coordinates")
+    return value
+
+def _distance(a, b):
+    # Distància en metres sobre l'esfera (haversine), com els índexs 2dsphere
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+def _within(point, shape):
+    if "$centerSphere" in shape:
+        center, radians = shape["$centerSphere"]
+        return _distance(center, point) <= radians * EARTH_RADIUS
+    if "$box" in shape:
+        (x1, y1), (x2, y2) = shape["$box"]
+        return x1 <= point[0] <= x2 and y1 <= point[1] <= y2
+    if "$center" in shape:
+        center, radius = shape["$center"]
+        return math.dist(center, point) <= radius
+    raise ValueError(f"Unsupported $geoWithin shape: {shape}")
+
+def _compare(operator, value, expected):
+    if operator == "$eq":
+        return value == expected or (isinstance(value, list) and expected in value)
+    if operator == "$ne":
+        return not _compare("$eq", value, expected)
+    if operator == "$in":
+        return any(_compare("$eq", value, item) for item in expected)
+    if operator == "$nin":
+        return not _compare("$in", value, expected)
+    if operator == "$exists":
+        return (value is not None) == bool(expected)
+    if value is None:
+        return False
+    try:
+        if operator == "$gt":
+            return value > expected
+        if operator == "$gte":
+            return value >= expected
+        if operator == "$lt":
+            return value < expected
+        if operator == "$lte":
+            return value <= expected
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported query operator: {operator}")
+
+def matches(document, query) -> bool:
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif field == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            value = _get_path(document, field)
+            for operator, expected in condition.items():
+                if operator in ("$near", "$nearSphere"):
+                    max_distance = expected.get("$maxDistance") if isinstance(expected, dict) else None
+                    max_distance = condition.get("$maxDistance", max_distance if max_distance is not None else math.inf)
+                    if value is None or _distance(_point(expected), _point(value)) > max_distance:
+                        return False
+                elif operator == "$geoWithin":
+                    if value is None or not _within(_point(value), expected):
+                        return False
+                elif operator in ("$maxDistance", "$minDistance"):
+                    continue
+                elif not _compare(operator, value, expected):
+                    return False
+        elif not _compare("$eq", _get_path(document, field), condition):
+            return False
+    return True
+
+def _near(query):
+    # Retorna (camp, punt) si la consulta ordena per distància
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            for operator in ("$near", "$nearSphere"):
+                if operator in condition:
+                    return field, _point(condition[operator])
+    return None
+
+def _project(document, projection):
+    document = copy.deepcopy(document)
+    if projection and projection.get("_id") == 0:
+        document.pop("_id", None)
+    return document
+
+class MemoryCollection:
+    def __init__(self):
+        self.documents = []
+        self.indexes = []
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def create_index(self, keys, **kwargs):
+        name = "_".join(f"{field}_{kind}" for field, kind in keys)
+        if name not in self.indexes:
+            self.indexes.append(name)
+        return name
+
+    def insert_one(self, document):
+        with self._lock:
+            self._next_id += 1
+            document.setdefault("_id", self._next_id)
+            self.documents.append(copy.deepcopy(document))
+            return document["_id"]
+
+    def replace_one(self, query, document, upsert=False):
+        with self._lock:
+            for i, current in enumerate(self.documents):
+                if matches(current, query):
+                    replacement = copy.deepcopy(document)
+                    replacement["_id"] = current["_id"]
+                    self.documents[i] = replacement
+                    return 1
+            if upsert:
+                self.insert_one(dict(document))
+            return 0
+
+    def delete_one(self, query):
+        with self._lock:
+            for i, current in enumerate(self.documents):
+                if matches(current, query):
+                    del self.documents[i]
+                    return 1
+            return 0
+
+    def delete_many(self, query):
+        with self._lock:
+            before = len(self.documents)
+            self.documents = [document for document in self.documents if not matches(document, query)]
+            return before - len(self.documents)
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        with self._lock:
+            found = [document for document in self.documents if matches(document, query)]
+        near = _near(query)
+        if near:
+            field, point = near
+            found.sort(key=lambda document: _distance(point, _point(_get_path(document, field))))
+        return [_project(document, projection) for document in found]
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+class MemoryMongoDBClient:
+    # Les bases de dades són compartides per tots els clients del procés
+    databases = {}
+
+    def __init__(self, host="localhost", port=27017):
+        self.host = host
+        self.port = port
+        self.database = None
+        self.collection = None
+
+    def close(self):
+        pass
+
+    @metrics.timed("mongodb")
+    def ping(self):
+        return {"ok": 1.0}
+
+    def getDatabase(self, database):
+        self.database = self.databases.setdefault(database, {})
+        return self.database
+
+    def getCollection(self, collection):
+        self.collection = self.database.setdefault(collection, MemoryCollection())
+        return self.collection
+
+    def clearDb(self, database):
+        MemoryMongoDBClient.databases.pop(database, None)
+
+    @metrics.timed("mongodb")
+    def insertDocument(self, document):
+        return self.collection.insert_one(document)
+
+    @metrics.timed("mongodb")
+    def upsertDocument(self, query, document):
+        return self.collection.replace_one(query, document, upsert=True)
+
+    @metrics.timed("mongodb")
+    def deleteDocument(self, query):
+        self.collection.delete_one(query)
+
+    @metrics.timed("mongodb")
+    def getDocuments(self, query):
+        return self.collection.find(query, {'_id': 0})
+
+    @metrics.timed("mongodb")
+    def getDocument(self, query):
+        return self.collection.find_one(query, {'_id': 0})
@@ -0,0 +1,322 @@
+import collections
+import fnmatch
+import functools
+import queue
+import threading
+import time
+
+from shared import metrics
+
+# Redis en memòria amb les ordres que fa servir l'aplicació. Com redis-py, retorna els valors com a bytes
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value).encode()
+    raise TypeError(f"Invalid input of type: {type(value).__name__!r}")
+
+def _score(value) -> float:
+    if value in ("-inf", b"-inf"):
+        return float("-inf")
+    if value in ("+inf", "inf", b"+inf", b"inf"):
+        return float("inf")
+    return float(value)
+
+def _rank_slice(length, start, end):
+    # Índexs inclusius i negatius com ZRANGE i ZREMRANGEBYRANK
+    if start < 0:
+        start = max(length + start, 0)
+    if end < 0:
+        end = length + end
+    # Si el final queda abans de l'inici el rang és buit
+    return start, max(min(end, length - 1), start - 1)
+
+class ZSet(dict):
+    # Sorted set: membre -> puntuació, ordenat per puntuació i després pel membre com Redis
+    def ordered(self):
+        return sorted(self.items(), key=lambda item: (item[1], item[0]))
+
+class MemoryPipeline:
+    # Guarda les ordres i les executa totes juntes i de manera atòmica a execute()
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        # Com amb el client real, les ordres del pipeline no es mesuren una a una: es mesura el pipeline sencer
+        method = getattr(type(self._client), name)
+        command = functools.partial(getattr(method, "__wrapped__", method), self._client)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    @metrics.timed("redis", "pipeline")
+    def execute(self):
+        commands, self._commands = self._commands, []
+        with self._client._lock:
+            return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+    def reset(self):
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+class MemoryPubSub:
+    # Com el PubSub de redis-py: rep els missatges publicats als canals subscrits a partir del moment de la subscripció
+    def __init__(self, channels, lock, ignore_subscribe_messages=False):
+        self._channels = channels
+        self._lock = lock
+        self._subscribed = set()
+        self._messages = queue.Queue()
+        self._ignore_subscribe_messages = ignore_subscribe_messages
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            channel = _encode(channel)
+            self._subscribed.add(channel)
+            with self._lock:
+                self._channels[channel].add(self)
+            if not self._ignore_subscribe_messages:
+                self._messages.put({"type": "subscribe", "pattern": None, "channel": channel, "data": len(self._subscribed)})
+
+    def unsubscribe(self, *channels):
+        for channel in [_encode(channel) for channel in channels] or list(self._subscribed):
+            self._subscribed.discard(channel)
+            with self._lock:
+                self._channels[channel].discard(self)
+
+    def deliver(self, channel, data):
+        self._messages.put({"type": "message", "pattern": None, "channel": channel, "data": data})
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return self._messages.get(timeout=timeout) if timeout else self._messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.unsubscribe()
+
+class MemoryRedisClient:
+    # Les dades són compartides per tots els clients del procés, com si es connectessin al mateix servidor
+    _data = {}
+    _expires = {}
+    _channels = collections.defaultdict(set)
+    _lock = threading.RLock()
+
+    def __init__(self, host='localhost', port=6379, db=0):
+        pass
+
+    def close(self):
+        pass
+
+    def _get(self, key, kind=None, create=False):
+        key = _encode(key)
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        value = self._data.get(key)
+        if value is None and create:
+            value = self._data[key] = kind()
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    @metrics.timed("redis")
+    def ping(self):
+        return True
+
+    @metrics.timed("redis")
+    def get(self, key):
+        with self._lock:
+            return self._get(key, bytes)
+
+    @metrics.timed("redis")
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            key = _encode(key)
+            if nx and self._get(key) is not None:
+                return None
+            self._data[key] = _encode(value)
+            self._expires.pop(key, None)
+            if ex is not None:
+                self._expires[key] = time.monotonic() + ex
+            return True
+
+    @metrics.timed("redis")
+    def mget(self, keys):
+        with self._lock:
+            return [self._get(key, bytes) for key in keys]
+
+    @metrics.timed("redis")
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                if self._get(key) is not None:
+                    del self._data[_encode(key)]
+                    self._expires.pop(_encode(key), None)
+                    deleted += 1
+            return deleted
+
+    unlink = delete
+
+    @metrics.timed("redis")
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._get(key) is not None)
+
+    @metrics.timed("redis")
+    def hset(self, key, mapping=None, field=None, value=None):
+        with self._lock:
+            mapping = dict(mapping or {})
+            if field is not None:
+                mapping[field] = value
+            hash_ = self._get(key, dict, create=True)
+            added = sum(1 for field in mapping if _encode(field) not in hash_)
+            hash_.update({_encode(field): _encode(value) for field, value in mapping.items()})
+            return added
+
+    @metrics.timed("redis")
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, dict) or {})
+
+    @metrics.timed("redis")
+    def hmget(self, key, fields):
+        with self._lock:
+            hash_ = self._get(key, dict) or {}
+            return [hash_.get(_encode(field)) for field in fields]
+
+    @metrics.timed("redis")
+    def sadd(self, key, *members):
+        with self._lock:
+            members = {_encode(member) for member in members}
+            set_ = self._get(key, set, create=True)
+            added = len(members - set_)
+            set_.update(members)
+            return added
+
+    @metrics.timed("redis")
+    def srem(self, key, *members):
+        with self._lock:
+            set_ = self._get(key, set)
+            if set_ is None:
+                return 0
+            members = {_encode(member) for member in members}
+            removed = len(members & set_)
+            set_.difference_update(members)
+            if not set_:
+                self.delete(key)
+            return removed
+
+    @metrics.timed("redis")
+    def replace_latest(self, key, score, mapping, set_key, member, in_set, only_if_newer=False):
+        # L'script REPLACE_LATEST del client real
+        with self._lock:
+            current = (self._get(key, dict) or {}).get(b"score")
+            if only_if_newer and current is not None and float(current) > float(score):
+                return -1
+            self._data.pop(_encode(key), None)
+            self._expires.pop(_encode(key), None)
+            self._get(key, dict, create=True).update({_encode(field): _encode(value) for field, value in {"score": score, **mapping}.items()})
+            set_ = self._get(set_key, set, create=in_set)
+            if in_set:
+                changed = _encode(member) not in set_
+                set_.add(_encode(member))
+            else:
+                changed = set_ is not None and _encode(member) in set_
+                if changed:
+                    set_.discard(_encode(member))
+                    if not set_:
+                        self._data.pop(_encode(set_key))
+            return int(changed)
+
+    @metrics.timed("redis")
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get(key, set) or ())
+
+    def zadd(self, key, mapping):
+        with self._lock:
+            zset = self._get(key, ZSet, create=True)
+            added = sum(1 for member in mapping if _encode(member) not in zset)
+            zset.update({_encode(member): float(score) for member, score in mapping.items()})
+            return added
+
+    def zrange(self, key, start, end, withscores=False):
+        with self._lock:
+            members = (self._get(key, ZSet) or ZSet()).ordered()
+            start, end = _rank_slice(len(members), start, end)
+            members = members[start:end + 1]
+            return members if withscores else [member for member, _ in members]
+
+    def zrangebyscore(self, key, min, max, withscores=False):
+        with self._lock:
+            low, high = _score(min), _score(max)
+            members = [(member, score) for member, score in (self._get(key, ZSet) or ZSet()).ordered() if low <= score <= high]
+            return members if withscores else [member for member, _ in members]
+
+    def zremrangebyscore(self, key, min, max):
+        with self._lock:
+            low, high = _score(min), _score(max)
+            return self._zrem(key, [member for member, score in (self._get(key, ZSet) or ZSet()).items() if low <= score <= high])
+
+    def zremrangebyrank(self, key, start, end):
+        with self._lock:
+            members = (self._get(key, ZSet) or ZSet()).ordered()
+            start, end = _rank_slice(len(members), start, end)
+            return self._zrem(key, [member for member, _ in members[start:end + 1]])
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._get(key, ZSet) or ())
+
+    def _zrem(self, key, members):
+        zset = self._get(key, ZSet)
+        for member in members:
+            del zset[member]
+        if zset is not None and not zset:
+            self.delete(key)
+        return len(members)
+
+    @metrics.timed("redis")
+    def publish(self, channel, message):
+        with self._lock:
+            receivers = list(self._channels[_encode(channel)])
+        for pubsub in receivers:
+            pubsub.deliver(_encode(channel), _encode(message))
+        return len(receivers)
+
+    def pubsub(self, **kwargs):
+        return MemoryPubSub(self._channels, self._lock, **kwargs)
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def scan_iter(self, pattern="*", count=1000):
+        with self._lock:
+            keys = [key for key in list(self._data) if self._get(key) is not None]
+        return iter([key for key in keys if fnmatch.fnmatchcase(key.decode(), pattern)])
+
+    def keys(self, pattern):
+        return list(self.scan_iter(pattern))
+
+    def clearPattern(self, pattern, batch_size=500):
+        return self.delete(*self.keys(pattern))
+
+    def clearNamespace(self, namespace, batch_size=500):
+        return self.clearPattern(f"{namespace}:*")
+
+    def clearAll(self, batch_size=500):
+        return self.clearPattern("*")
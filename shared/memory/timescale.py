@@ -0,0 +1,175 @@
+import datetime
+import re
+import sqlite3
+import threading
+
+from shared import metrics
+from shared.sensors import timeseries
+
+# TimescaleDB en memòria sobre SQLite. Les consultes de l'aplicació funcionen sense canvis: convertim els marcadors %s de
+# psycopg2, registrem time_bucket() i guardem els timestamps en un format de text que s'ordena i es compara com les dates.
+# En llegir els resultats els tornem a convertir a datetime, com fa psycopg2 amb les columnes timestamp
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+_ISO_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?$")
+_QUOTED_TIMESTAMP = re.compile(r"'(\d{4}-\d{2}-\d{2}[T ][^']*)'")
+_STORED_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{6}$")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sensor_data (
+        id integer NOT NULL,
+        temperature float,
+        humidity float,
+        velocity float,
+        battery_level float NOT NULL,
+        last_seen timestamp NOT NULL,
+        PRIMARY KEY (id, last_seen)
+    );
+    CREATE TABLE IF NOT EXISTS sensor_meta (
+        id integer PRIMARY KEY,
+        type text NOT NULL,
+        name text
+    );
+"""
+
+def _to_db(value):
+    # Els timestamps ISO (amb T o Z) es guarden en un format únic perquè les comparacions de text siguin correctes
+    if isinstance(value, datetime.datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    if isinstance(value, str) and _ISO_TIMESTAMP.match(value):
+        return timeseries.parse_timestamp(value.replace(" ", "T")).strftime(TIMESTAMP_FORMAT)
+    return value
+
+def _from_db(value):
+    if isinstance(value, str) and _STORED_TIMESTAMP.match(value):
+        return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+    return value
+
+def _time_bucket(interval, timestamp):
+    # time_bucket('1 hour', last_seen). Només intervals d'una unitat, els que fa servir get_data
+    if timestamp is None:
+        return None
+    amount, unit = interval.split()
+    unit = unit.lower().rstrip("s")
+    if amount != "1" or unit not in timeseries.BUCKETS:
+        raise ValueError(f"Unsupported time_bucket interval: {interval}")
+    start = timeseries.time_bucket(unit, datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT))
+    return start.strftime(TIMESTAMP_FORMAT)
+
+class _StddevPop:
+    # STDDEV_POP de PostgreSQL, com a agregat i com a funció de finestra
+    def __init__(self):
+        self.count, self.total, self.squares = 0, 0.0, 0.0
+
+    def step(self, value):
+        if value is not None:
+            self.count, self.total, self.squares = self.count + 1, self.total + value, self.squares + value * value
+
+    def inverse(self, value):
+        if value is not None:
+            self.count, self.total, self.squares = self.count - 1, self.total - value, self.squares - value * value
+
+    def value(self):
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return max(self.squares / self.count - mean * mean, 0.0) ** 0.5
+
+    finalize = value
+
+def _translate(query):
+    # Literals de timestamp al format guardat i marcadors de psycopg2 als de sqlite3
+    query = _QUOTED_TIMESTAMP.sub(lambda match: "'" + _to_db(match.group(1)) + "'", query)
+    return query.replace("%s", "?")
+
+def connect():
+    conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level="DEFERRED")
+    conn.create_function("time_bucket", 2, _time_bucket, deterministic=True)
+    conn.create_window_function("stddev_pop", 1, _StddevPop)
+    conn.executescript(SCHEMA)
+    return conn
+
+class MemoryCursor:
+    def __init__(self, conn, lock):
+        self._conn = conn
+        self._lock = lock
+        self._cursor = conn.cursor()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, query, parameters=()):
+        statement = query.strip().rstrip(";").strip().lower()
+        with self._lock:
+            if statement == "commit":
+                return self._conn.commit()
+            if statement == "rollback":
+                return self._conn.rollback()
+            return self._cursor.execute(_translate(query), [_to_db(value) for value in parameters])
+
+    def execute_values(self, query, rows):
+        # Com psycopg2.extras.execute_values: "VALUES %s" amb una tupla per fila
+        rows = [[_to_db(value) for value in row] for row in rows]
+        if not rows:
+            return None
+        query = _translate(query.replace("VALUES %s", "VALUES (" + ", ".join("?" * len(rows[0])) + ")"))
+        with self._lock:
+            return self._cursor.executemany(query, rows)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else tuple(_from_db(value) for value in row)
+
+    def fetchmany(self, size=None):
+        return [tuple(_from_db(value) for value in row) for row in self._cursor.fetchmany(size or self._cursor.arraysize)]
+
+    def fetchall(self):
+        return [tuple(_from_db(value) for value in row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+class MemoryTimescale:
+    # Totes les instàncies comparteixen la mateixa base de dades, com les connexions a un mateix servidor
+    _conn = None
+    _lock = threading.RLock()
+
+    def __init__(self):
+        with MemoryTimescale._lock:
+            if MemoryTimescale._conn is None:
+                MemoryTimescale._conn = connect()
+        self.conn = MemoryTimescale._conn
+        self.cursor = MemoryCursor(self.conn, MemoryTimescale._lock)
+
+    def getCursor(self):
+        return self.cursor
+
+    def close(self):
+        self.cursor.close()
+
+    def rollback(self):
+        with MemoryTimescale._lock:
+            self.conn.rollback()
+
+    def ping(self):
+        return True
+
+    @metrics.timed("timescale")
+    def execute(self, query, parameters=None):
+        return self.cursor.execute(query, parameters or ())
+
+    @metrics.timed("timescale")
+    def execute_values(self, query, rows):
+        return self.cursor.execute_values(query, rows)
+
+    def delete(self, table):
+        self.cursor.execute("DELETE FROM " + table)
+        self.conn.commit()
@@ -0,0 +1,312 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Mètriques en memòria del procés amb sortida en format de text de Prometheus.
+# Cada sèrie és una combinació de valors d'etiquetes; les operacions només prenen el lock de la mètrica.
+# Amb diversos processos que serveixen la mateixa API (workers de gunicorn), cada procés escriu les seves sèries a un directori
+# compartit cada FLUSH_INTERVAL segons i /metrics les suma totes (vegeu start_multiprocess). Els comptadors i els histogrames
+# dels processos que han acabat es conserven, perquè els totals no baixin quan es reinicia un worker; els gauges només dels vius.
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            series = dict(self._series)
+        for key, value in sorted(series.items()):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+    def _options(self):
+        # Arguments del constructor, a més del nom, la descripció i les etiquetes, per tornar a crear la mètrica en un altre procés
+        return {}
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(key), json.loads(json.dumps(value))] for key, value in self._series.items()]
+        return {"type": self.type, "name": self.name, "documentation": self.documentation, "labelnames": list(self.labelnames),
+                "options": self._options(), "series": series}
+
+    def merge(self, key, value):
+        # Suma a la sèrie el valor d'un altre procés
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), aggregate="sum"):
+        # aggregate: com s'ajunten els valors dels processos, "sum" (per exemple, missatges al buffer de cada worker)
+        # o "max" (un valor que tots els processos mostregen, com la mida d'una cua)
+        super().__init__(name, documentation, labelnames)
+        self.aggregate = aggregate
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def _options(self):
+        return {"aggregate": self.aggregate}
+
+    def merge(self, key, value):
+        if self.aggregate == "sum":
+            return super().merge(key, value)
+        with self._lock:
+            self._series[key] = max(self._series.get(key, value), value)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Comptadors per interval (l'últim és +Inf), suma i nombre d'observacions
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _options(self):
+        return {"buckets": list(self.buckets)}
+
+    def merge(self, key, value):
+        counts, total, count = value
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0] = [current + added for current, added in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), aggregate="sum"):
+        return self._get_or_create(Gauge, name, documentation, labelnames, aggregate=aggregate)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [metric.snapshot() for metric in metrics]
+
+    def load(self, snapshot):
+        # Afegeix les sèries d'una snapshot (d'aquest o d'un altre procés) a les d'aquest registre
+        for entry in snapshot:
+            metric = self._get_or_create(METRIC_TYPES[entry["type"]], entry["name"], entry["documentation"], entry["labelnames"], **entry["options"])
+            for key, value in entry["series"]:
+                metric.merge(tuple(key), value)
+
+
+METRIC_TYPES = {cls.type: cls for cls in (Counter, Gauge, Histogram)}
+
+registry = Registry()
+
+# Segons entre les escriptures de les mètriques de cada procés al directori compartit
+FLUSH_INTERVAL = 1.0
+# Directori compartit de les mètriques dels processos (None: només les d'aquest procés)
+_multiprocess_dir = None
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f"metrics_{pid}.json")
+
+
+def write_snapshot(directory, source=None, pid=None):
+    # Escriu les mètriques del procés en un fitxer nou i el mou a sobre de l'anterior: els lectors mai veuen un fitxer a mitges
+    path = _snapshot_path(directory, pid or os.getpid())
+    with open(path + ".tmp", "w") as file:
+        json.dump((source or registry).snapshot(), file)
+    os.replace(path + ".tmp", path)
+
+
+def aggregate(directory) -> Registry:
+    # Registre amb la suma de les mètriques de tots els processos que han escrit al directori
+    merged = Registry()
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("metrics_") and name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    merged.load(json.load(file))
+            except FileNotFoundError:
+                pass
+    return merged
+
+
+def mark_process_dead(directory, pid):
+    # Un procés ha acabat: es conserven els seus comptadors i histogrames, però els seus gauges ja no valen
+    path = _snapshot_path(directory, pid)
+    try:
+        with open(path) as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return
+    with open(path + ".tmp", "w") as file:
+        json.dump([entry for entry in snapshot if entry["type"] != Gauge.type], file)
+    os.replace(path + ".tmp", path)
+
+
+def clear_multiprocess(directory):
+    # Esborra les mètriques d'una execució anterior. S'ha de cridar abans d'arrencar els processos
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith("metrics_"):
+            os.remove(os.path.join(directory, name))
+
+
+def start_multiprocess(directory, interval=FLUSH_INTERVAL):
+    # Cada interval segons escriu les mètriques del procés al directori, i render() les suma amb les dels altres processos
+    global _multiprocess_dir
+    _multiprocess_dir = directory
+
+    def flush():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(directory)
+            except Exception as e:
+                print(f"Could not write the metrics to {directory}: {e!r}")
+
+    threading.Thread(target=flush, name="metrics-flush", daemon=True).start()
+
+
+def stop_multiprocess():
+    # Escriu les últimes mètriques del procés abans que acabi
+    if _multiprocess_dir is not None:
+        write_snapshot(_multiprocess_dir)
+
+
+def render():
+    # Mètriques de tots els processos si comparteixen directori, i si no les d'aquest procés
+    if _multiprocess_dir is None:
+        return registry.render()
+    # Les del procés que respon, al dia
+    write_snapshot(_multiprocess_dir)
+    return aggregate(_multiprocess_dir).render()
+
+store_duration = registry.histogram("store_operation_duration_seconds", "Latency of the operations on each store", ("store", "operation"))
+store_errors = registry.counter("store_operation_errors_total", "Operations on each store that raised an exception", ("store", "operation"))
+
+
+@contextmanager
+def timer(store, operation):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        store_errors.inc(store=store, operation=operation)
+        raise
+    finally:
+        store_duration.observe(time.perf_counter() - start, store=store, operation=operation)
+
+
+def timed(store, operation=None):
+    # Decorador per als mètodes dels clients de shared/: mesura la latència i compta els errors de cada crida
+    def decorator(function):
+        name = operation or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(store, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_http_server(port, host="0.0.0.0"):
+    # Exposa /metrics en un fil propi, per als processos que no són l'API (consumidor, relay)
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE + "; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
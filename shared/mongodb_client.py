@@ -1,16 +1,21 @@
 from pymongo import MongoClient
+from shared import connections, metrics
 
 class MongoDBClient:
+    # MongoClient és thread-safe però no fork-safe: en fem servir un per procés. La base de dades i la col·lecció
+    # seleccionades són de cada instància, i cada petició en crea una, així els fils no es trepitgen
     def __init__(self, host="localhost", port=27017):
         self.host = host
         self.port = port
-        self.client = MongoClient(host, port)
+        self.client = connections.per_process(("mongodb", host, port), lambda: MongoClient(host, port))
         self.database = None
         self.collection = None
 
     def close(self):
-        self.client.close()
+        # El MongoClient és del procés: no es tanca en acabar cada petició
+        pass
     
+    @metrics.timed("mongodb")
     def ping(self):
         return self.client.db_name.command('ping')
     
@@ -26,18 +31,27 @@ class MongoDBClient:
         self.client.drop_database(database)
         
      # Funció per inserir un document a la col·lecció 
+    @metrics.timed("mongodb")
     def insertDocument(self,document):
         return self.collection.insert_one(document)
     
+    # Funció per inserir o substituir el document que compleix la query
+    @metrics.timed("mongodb")
+    def upsertDocument(self,query,document):
+        return self.collection.replace_one(query, document, upsert=True)
+
     # Funció per esborrar un document de la col·lecció
+    @metrics.timed("mongodb")
     def deleteDocument(self,query):
         self.collection.delete_one(query)
 
     # Funció per obtenir els documents de la col·lecció 
+    @metrics.timed("mongodb")
     def getDocuments(self,query):
-        return self.collection.find(query, {'_id': 0})
+        return list(self.collection.find(query, {'_id': 0}))
     
     # Funció per obtenir un document de la col·lecció 
+    @metrics.timed("mongodb")
     def getDocument(self,query):
         return self.collection.find_one(query, {'_id': 0})
 
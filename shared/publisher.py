@@ -1,33 +1,327 @@
-import pika
+import collections
+import queue
+import threading
 import time
 
-QUEUE_NAME = 'test'
+import pika
+from pika.exceptions import AMQPError, NackError
+
+from shared import metrics, wire
 
-class Publisher:
+# Les lectures es reparteixen entre diverses cues (shards) segons l'id del sensor a través d'un exchange directe.
+# Totes les lectures d'un sensor van a la mateixa cua, i com que cada cua només té un consumidor actiu
+# (x-single-active-consumer) es processen en ordre.
+EXCHANGE_NAME = 'sensor_data'
+# Els missatges que no es poden processar acaben a la cua de dead letters per revisar-los
+DEAD_LETTER_EXCHANGE = f"{EXCHANGE_NAME}.dlx"
+DEAD_LETTER_QUEUE = f"{EXCHANGE_NAME}.dead"
+# Els avisos (per exemple, canvis de bateria baixa) van a un exchange fanout: cada servei de notificacions hi pot lligar la seva cua
+ALERTS_EXCHANGE = "sensor_alerts"
+ALERTS_QUEUE = "sensor_alerts"
+# Cua de l'endpoint d'exemple, a la qual es publica a través de l'exchange per defecte
+EXAMPLE_QUEUE = "test"
+
+buffered_messages = metrics.registry.gauge("publisher_buffered_messages", "Messages waiting in the publisher buffer or for a broker confirm")
+rejected_messages = metrics.registry.counter("publisher_rejected_messages_total", "Messages refused because the publisher buffer was full")
+queue_messages = metrics.registry.gauge("queue_messages", "Messages waiting in each queue at the last sample", ("queue",), aggregate="max")
+queue_consumers = metrics.registry.gauge("queue_consumers", "Consumers attached to each queue at the last sample", ("queue",), aggregate="max")
+
+def shard_for(sensor_id: int, shards: int) -> int:
+    return sensor_id % shards
+
+def queue_name(shard: int) -> str:
+    return f"{EXCHANGE_NAME}.{shard}"
 
-    channel = None
-    conn = None
+def retry_queue_name(shard: int) -> str:
+    return f"{queue_name(shard)}.retry"
 
-    def __init__(self):
-        credentials = pika.PlainCredentials('guest', 'guest')
-        parameters = pika.ConnectionParameters('rabbitmq',
-                                       5672,
+def declare_topology(channel, shards: int, max_length: int = None, overflow: str = "reject-publish"):
+    # Amb max_length les cues tenen una mida màxima. Amb overflow reject-publish el broker rebutja (nack) els missatges nous
+    # quan una cua és plena, i el publicador els reintenta més tard en lloc de perdre'ls
+    arguments = {"x-single-active-consumer": True, "x-dead-letter-exchange": DEAD_LETTER_EXCHANGE}
+    if max_length:
+        arguments["x-max-length"] = max_length
+        arguments["x-overflow"] = overflow
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct', durable=True)
+    for shard in range(shards):
+        channel.queue_declare(queue=queue_name(shard), durable=True, arguments=arguments)
+        channel.queue_bind(queue=queue_name(shard), exchange=EXCHANGE_NAME, routing_key=str(shard))
+    channel.exchange_declare(exchange=ALERTS_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_declare(queue=ALERTS_QUEUE, durable=True)
+    channel.queue_bind(queue=ALERTS_QUEUE, exchange=ALERTS_EXCHANGE)
+    channel.queue_declare(queue=EXAMPLE_QUEUE)
+
+def declare_retry_topology(channel, shards: int, retry_delay: int):
+    # Els missatges rebutjats sense reencuar van a la cua de dead letters
+    channel.exchange_declare(exchange=DEAD_LETTER_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+    channel.queue_bind(queue=DEAD_LETTER_QUEUE, exchange=DEAD_LETTER_EXCHANGE)
+    # Cada shard té una cua de reintents: els missatges hi esperen retry_delay ms i tornen a la cua del seu shard
+    for shard in range(shards):
+        channel.queue_declare(queue=retry_queue_name(shard), durable=True, arguments={
+            "x-message-ttl": retry_delay,
+            "x-dead-letter-exchange": EXCHANGE_NAME,
+            "x-dead-letter-routing-key": str(shard),
+        })
+
+class Publisher:
+    # Els missatges es guarden en un buffer local limitat i un fil propi els publica a RabbitMQ.
+    # Així publish() no bloqueja el fil de la petició i el buffer aguanta les caigudes del broker.
+    # Només el fil de publicació fa servir la connexió de pika, que no és thread-safe.
+    # overloaded() indica quan cal aplicar control d'admissió: el buffer és gairebé ple, el broker ha bloquejat la connexió,
+    # o la cua del sensor rebutja missatges o supera el límit (els consumidors d'aquell shard no donen l'abast).
+    # Quan una cua rebutja un missatge, els seus missatges esperen apart (en ordre) i els de les altres cues se segueixen enviant.
+
+    def __init__(self, host='rabbitmq', port=5672, shards=4, buffer_size=10000, batch_size=100, max_backoff=30,
+                 max_length=None, overflow="reject-publish", high_watermark=0.8, monitor_interval=5):
+        self.parameters = pika.ConnectionParameters(host,
+                                       port,
                                        '/',
-                                       credentials)
-        try:
-            self.conn = pika.BlockingConnection(parameters)
-        except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+                                       pika.PlainCredentials('guest', 'guest'),
+                                       heartbeat=30,
+                                       blocked_connection_timeout=60)
+        self.shards = shards
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.max_length = max_length
+        self.overflow = overflow
+        self.high_watermark = high_watermark
+        self.monitor_interval = monitor_interval
+        self.conn = None
+        self.channel = None
+        self.blocked = False
+        # Cues (exchange, routing key) que han rebutjat l'últim missatge. Només el fil de publicació la substitueix
+        self.rejected = frozenset()
+        # Missatges retinguts de cada cua que rebutja, quan es tornaran a provar i l'espera actual
+        self._held = {}
+        self._retry_at = {}
+        self._backoffs = {}
+        # Missatges a cada cua i consumidors, segons l'última mostra
+        self.queue_stats = {}
+        self._buffer_size = buffer_size
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        # Última lectura de cada sensor mentre hi ha sobrecàrrega i la política és coalesce
+        self._coalesced = {}
+        # Missatges ja trets del buffer que s'han de tornar a enviar després d'una reconnexió
+        self._pending = collections.deque()
+        self._idle = threading.Condition()
+        self._unsent = 0
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self._thread.start()
+
+    def publish(self, message, coalesce=False) -> bool:
+        # El missatge ha de tenir content_type i to_bytes(). Retorna False si el buffer és ple (el broker no respon o no dona l'abast).
+        # Les lectures (amb sensor_id) van a la cua del shard del sensor, i amb coalesce només es guarda l'última de cada sensor
+        # fins que es pugui enviar. Els altres missatges indiquen on van amb els atributs exchange i routing_key (per defecte "")
+        body = message.to_bytes()
+        exchange = getattr(message, "exchange", EXCHANGE_NAME)
+        routing_key = str(shard_for(message.sensor_id, self.shards)) if exchange == EXCHANGE_NAME else getattr(message, "routing_key", "")
+        with self._idle:
+            if coalesce:
+                if message.sensor_id not in self._coalesced:
+                    self._unsent += 1
+                self._coalesced[message.sensor_id] = (exchange, routing_key, message.content_type, body, 1)
+                return True
+            # Si el sensor té una lectura acumulada, és més antiga que aquesta: la posem al buffer davant seu
+            if exchange == EXCHANGE_NAME and message.sensor_id in self._coalesced:
+                try:
+                    self._buffer.put_nowait(self._coalesced[message.sensor_id])
+                except queue.Full:
+                    rejected_messages.inc()
+                    return False
+                del self._coalesced[message.sensor_id]
+            try:
+                self._buffer.put_nowait((exchange, routing_key, message.content_type, body, 1))
+            except queue.Full:
+                rejected_messages.inc()
+                return False
+            self._unsent += 1
+        return True
+
+    def buffered(self) -> int:
+        return self._unsent
 
+    def overloaded(self, sensor_id=None) -> bool:
+        # Amb sensor_id només compta la cua on aniria la lectura d'aquell sensor; sense, qualsevol cua
+        if self.blocked or self._buffer.qsize() >= self.high_watermark * self._buffer_size:
+            return True
+        shards = range(self.shards) if sensor_id is None else [shard_for(sensor_id, self.shards)]
+        rejected = self.rejected
+        for shard in shards:
+            if (EXCHANGE_NAME, str(shard)) in rejected:
+                return True
+            stats = self.queue_stats.get(queue_name(shard))
+            if self.max_length and stats and stats["messages"] >= self.high_watermark * self.max_length:
+                return True
+        return False
+
+    def status(self) -> dict:
+        return {
+            "connected": self.conn is not None,
+            "blocked": self.blocked,
+            "rejected": sorted(queue_name(int(routing_key)) if exchange == EXCHANGE_NAME else exchange for exchange, routing_key in self.rejected),
+            "overloaded": self.overloaded(),
+            "buffered": self._unsent,
+            "buffer_size": self._buffer_size,
+            "coalesced": len(self._coalesced),
+            "queues": dict(self.queue_stats),
+        }
+
+    def flush(self, timeout=None) -> bool:
+        # Espera fins que el broker ha confirmat tots els missatges publicats fins ara
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unsent == 0, timeout)
+
+    def close(self, timeout=10):
+        self.flush(timeout)
+        self._closing.set()
+        self._thread.join(timeout)
+
+    def _connect(self):
+        self.conn = pika.BlockingConnection(self.parameters)
         self.channel = self.conn.channel()
-        self.channel.queue_declare(queue=QUEUE_NAME)
+        # Mode confirmació: el broker confirma cada missatge un cop l'ha guardat
+        self.channel.confirm_delivery()
+        declare_topology(self.channel, self.shards, self.max_length, self.overflow)
+        # Quan el broker es queda sense recursos bloqueja les connexions que publiquen
+        self.conn.add_on_connection_blocked_callback(self._on_blocked)
+        self.conn.add_on_connection_unblocked_callback(self._on_unblocked)
+
+    def _on_blocked(self, connection, method):
+        self.blocked = True
+
+    def _on_unblocked(self, connection, method):
+        self.blocked = False
+
+    def _sample_queues(self):
+        # Consulta passiva: no crea res, només retorna els missatges pendents i els consumidors de cada cua
+        for shard in range(self.shards):
+            result = self.channel.queue_declare(queue=queue_name(shard), passive=True)
+            self.queue_stats[queue_name(shard)] = {"messages": result.method.message_count, "consumers": result.method.consumer_count}
+            queue_messages.set(result.method.message_count, queue=queue_name(shard))
+            queue_consumers.set(result.method.consumer_count, queue=queue_name(shard))
+
+    def _disconnect(self):
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+        self.channel = None
+
+    def _next_batch(self):
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            batch.append(self._pending.popleft())
+        try:
+            if not batch:
+                batch.append(self._buffer.get(timeout=0.1))
+            while len(batch) < self.batch_size:
+                batch.append(self._buffer.get_nowait())
+        except queue.Empty:
+            pass
+        # Les últimes lectures acumulades s'envien cada vegada que el buffer queda buit, encara que arribin lectures d'altres sensors:
+        # les anteriors del mateix sensor ja s'han tret del buffer, i publish() hi posa l'acumulada davant de qualsevol de posterior
+        if len(batch) < self.batch_size and self._coalesced:
+            with self._idle:
+                while self._coalesced and len(batch) < self.batch_size:
+                    batch.append(self._coalesced.pop(next(iter(self._coalesced))))
+        return self._pack(batch)
+
+    @staticmethod
+    def _pack(batch):
+        # Ajunta les lectures consecutives que van a la mateixa cua en un sol missatge, i per tant en una sola confirmació
+        groups = []
+        for exchange, routing_key, content_type, body, count in batch:
+            if groups and content_type == wire.READINGS_CONTENT_TYPE and groups[-1][:3] == [exchange, routing_key, content_type]:
+                groups[-1][3].append(body)
+                groups[-1][4] += count
+            else:
+                groups.append([exchange, routing_key, content_type, [body], count])
+        return [(exchange, routing_key, content_type, bodies[0] if len(bodies) == 1 else wire.merge_readings(bodies), count)
+                for exchange, routing_key, content_type, bodies, count in groups]
+
+    def _hold(self, message):
+        # La cua ha rebutjat el missatge (és plena, reject-publish): el retenim, amb els que vinguin després cap a la mateixa cua,
+        # fins que passi l'espera d'aquella cua, que es dobla a cada rebuig
+        key = message[:2]
+        backoff = min(self._backoffs.get(key, 0.5) * 2, self.max_backoff)
+        self._backoffs[key] = backoff
+        self._retry_at[key] = time.monotonic() + backoff
+        self._held[key] = collections.deque([message])
+        self.rejected = frozenset(self._backoffs)
+
+    def _release_held(self):
+        # Els missatges retinguts de les cues que ja han esperat prou tornen al davant dels pendents
+        now = time.monotonic()
+        for key in [key for key, retry_at in self._retry_at.items() if retry_at <= now]:
+            del self._retry_at[key]
+            self._pending.extendleft(reversed(self._held.pop(key)))
 
+    def _send(self, batch):
+        for i, (exchange, routing_key, content_type, body, count) in enumerate(batch):
+            held = self._held.get((exchange, routing_key))
+            if held is not None:
+                # La cua encara rebutja missatges: aquest espera darrere dels retinguts perquè no passi davant seu
+                held.append(batch[i])
+                continue
+            try:
+                # Amb confirmacions, basic_publish no retorna fins que el broker ha confirmat el missatge
+                with metrics.timer("rabbitmq", "publish"):
+                    self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                               properties=pika.BasicProperties(content_type=content_type, delivery_mode=2,
+                                                                               headers={"x-published-at": int(time.time() * 1000)}))
+            except NackError:
+                self._hold(batch[i])
+                continue
+            except Exception:
+                # Els missatges no confirmats es tornen a enviar, en ordre, quan es recuperi la connexió
+                self._pending.extendleft(reversed(batch[i:]))
+                raise
+            if self._backoffs.pop((exchange, routing_key), None) is not None:
+                self.rejected = frozenset(self._backoffs)
+            with self._idle:
+                self._unsent -= count
+                self._idle.notify_all()
 
-    
-    def publish(self, message):
-        self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.to_json())
-        print(" [x] Sent %r" % message)
-    
-    def close(self):
-        self.conn.close()
+    def _run(self):
+        backoff = 1
+        sampled_at = 0
+        while not self._closing.is_set():
+            if self.conn is None:
+                try:
+                    self._connect()
+                    backoff = 1
+                except Exception as e:
+                    print(f"Publisher cannot connect to RabbitMQ, retrying in {backoff}s: {e!r}")
+                    # Si ha fallat a mitges (per exemple, declarant les cues) la connexió oberta no serveix
+                    self._disconnect()
+                    self._closing.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+            try:
+                if time.monotonic() - sampled_at >= self.monitor_interval:
+                    self._sample_queues()
+                    sampled_at = time.monotonic()
+                buffered_messages.set(self._unsent)
+                self._release_held()
+                batch = self._next_batch()
+                if batch:
+                    self._send(batch)
+                    backoff = 1
+                else:
+                    # Sense missatges: atenem els heartbeats de la connexió
+                    self.conn.process_data_events(time_limit=0)
+            except AMQPError as e:
+                print(f"Publisher lost the connection to RabbitMQ: {e!r}")
+                self._disconnect()
+            except Exception as e:
+                # Qualsevol altre error tampoc pot aturar el fil, o els missatges es quedarien al buffer per sempre:
+                # tornem a començar amb una connexió nova després d'esperar
+                print(f"Publisher failed, reconnecting in {backoff}s: {e!r}")
+                self._disconnect()
+                self._closing.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self._disconnect()
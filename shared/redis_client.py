@@ -1,31 +1,155 @@
+import itertools
+
 import redis
+from shared import connections, metrics
+
+# Substitueix el hash KEYS[1] pels parells camp, valor d'ARGV[5..] amb la puntuació ARGV[2] (camp score), i afegeix ARGV[1] al
+# conjunt KEYS[2] si ARGV[3] és 1 o el treu si és 0, tot de manera atòmica. Si ARGV[4] és 1 i el hash ja guarda una puntuació
+# més gran no fa res. Retorna -1 si no ha fet res, 1 si el membre ha entrat o sortit del conjunt i 0 si no
+REPLACE_LATEST = """
+local current = redis.call('HGET', KEYS[1], 'score')
+if ARGV[4] == '1' and current and tonumber(current) > tonumber(ARGV[2]) then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'score', ARGV[2])
+for i = 5, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if ARGV[3] == '1' then
+    return redis.call('SADD', KEYS[2], ARGV[1])
+end
+return redis.call('SREM', KEYS[2], ARGV[1])
+"""
+
+def _replace_latest_arguments(key, score, mapping, set_key, member, in_set, only_if_newer):
+    return [key, set_key], [member, score, int(in_set), int(only_if_newer), *itertools.chain.from_iterable(mapping.items())]
+
+# Pipeline que mesura el temps de cada execute()
+class TimedPipeline:
+    def __init__(self, pipeline, replace_latest):
+        self._pipeline = pipeline
+        self._replace_latest = replace_latest
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+    def replace_latest(self, key, score, mapping, set_key, member, in_set, only_if_newer=False):
+        keys, args = _replace_latest_arguments(key, score, mapping, set_key, member, in_set, only_if_newer)
+        self._replace_latest(keys=keys, args=args, client=self._pipeline)
+        return self
+
+    def execute(self):
+        with metrics.timer("redis", "pipeline"):
+            return self._pipeline.execute()
 
 class RedisClient:
     def __init__(self, host='localhost', port=6379, db=0):
         self._host = host
         self._port = port
         self._db = db
-        self._client = redis.Redis(host=self._host, port=self._port, db=self._db)
+        # redis.Redis és thread-safe i té el seu pool de connexions: en compartim un per procés
+        self._client = connections.per_process(("redis", host, port, db), lambda: redis.Redis(host=self._host, port=self._port, db=self._db))
+        self._replace_latest = self._client.register_script(REPLACE_LATEST)
     
     def close(self):
-        self._client.close()
+        # Les connexions són del pool del procés: no es tanquen en acabar cada petició
+        pass
 
+    @metrics.timed("redis")
     def ping(self):
         return self._client.ping()
     
+    @metrics.timed("redis")
     def get(self, key):
         return self._client.get(key)
     
-    def set(self, key, value):
-        return self._client.set(key, value)
+    @metrics.timed("redis")
+    def set(self, key, value, ex=None, nx=False):
+        return self._client.set(key, value, ex=ex, nx=nx)
     
-    def delete(self, key):
-        return self._client.delete(key)
+    @metrics.timed("redis")
+    def mget(self, keys):
+        return self._client.mget(keys)
+
+    @metrics.timed("redis")
+    def delete(self, *keys):
+        return self._client.delete(*keys)
+
+    @metrics.timed("redis")
+    def exists(self, *keys):
+        return self._client.exists(*keys)
     
-    def keys(self, pattern):
-        return self._client.keys(pattern)
+    @metrics.timed("redis")
+    def hset(self, key, mapping):
+        return self._client.hset(key, mapping=mapping)
+
+    @metrics.timed("redis")
+    def hgetall(self, key):
+        return self._client.hgetall(key)
+
+    @metrics.timed("redis")
+    def hmget(self, key, fields):
+        return self._client.hmget(key, fields)
+
+    @metrics.timed("redis")
+    def sadd(self, key, *members):
+        return self._client.sadd(key, *members)
+
+    @metrics.timed("redis")
+    def srem(self, key, *members):
+        return self._client.srem(key, *members)
+
+    @metrics.timed("redis")
+    def smembers(self, key):
+        return self._client.smembers(key)
+
+    @metrics.timed("redis")
+    def publish(self, channel, message):
+        return self._client.publish(channel, message)
+
+    @metrics.timed("redis")
+    def replace_latest(self, key, score, mapping, set_key, member, in_set, only_if_newer=False):
+        keys, args = _replace_latest_arguments(key, score, mapping, set_key, member, in_set, only_if_newer)
+        return self._replace_latest(keys=keys, args=args)
+
+    def pubsub(self, **kwargs):
+        return self._client.pubsub(**kwargs)
+
+    # Retorna un pipeline per agrupar diverses ordres en una sola anada i tornada
+    def pipeline(self, transaction=True):
+        return TimedPipeline(self._client.pipeline(transaction=transaction), self._replace_latest)
     
-    def clearAll(self):
-        for key in self._client.keys("*"):
-            self._client.delete(key)
+    # Recorre les claus amb SCAN per no bloquejar Redis (KEYS recorre tot l'espai de claus d'un cop)
+    def scan_iter(self, pattern="*", count=1000):
+        return self._client.scan_iter(match=pattern, count=count)
+
+    def keys(self, pattern):
+        return list(self.scan_iter(pattern))
+
+    # Esborra les claus que coincideixen amb el patró en lots, amb UNLINK (l'alliberament de memòria es fa en segon pla)
+    def clearPattern(self, pattern, batch_size=500):
+        deleted = 0
+        batch = []
+        for key in self.scan_iter(pattern, count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += self._unlink(batch)
+                batch = []
+        if batch:
+            deleted += self._unlink(batch)
+        return deleted
+
+    # Esborra només les claus d'un espai de noms (prefix "<namespace>:")
+    def clearNamespace(self, namespace, batch_size=500):
+        return self.clearPattern(f"{namespace}:*", batch_size=batch_size)
+
+    def clearAll(self, batch_size=500):
+        return self.clearPattern("*", batch_size=batch_size)
+
+    @metrics.timed("redis", "unlink")
+    def _unlink(self, keys):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.unlink(*keys)
+        return sum(pipe.execute())
     
@@ -0,0 +1,57 @@
+import json
+from typing import Collection, List, Tuple
+
+from shared import wire
+from shared.publisher import ALERTS_EXCHANGE
+from shared.sensors.keys import LOW_BATTERY_KEY, latest_key
+from shared.settings import settings
+
+# Avisos de bateria baixa. En enregistrar les lectures mantenim a Redis el conjunt de sensors per sota del llindar:
+# SADD i SREM retornen 1 només quan el sensor hi entra o en surt, i aquests canvis són els que es publiquen com a avís.
+# Una lectura repetida (per exemple, un missatge que el broker torna a entregar) no genera un avís nou. Un missatge que el consumidor
+# torna a processar (un reintent que arriba després de lectures més noves) no toca ni l'última lectura ni el conjunt si és més antic
+BATTERY_LOW = "battery_low"
+BATTERY_OK = "battery_ok"
+
+class AlertMessage:
+    content_type = wire.JSON_CONTENT_TYPE
+    exchange = ALERTS_EXCHANGE
+
+    def __init__(self, sensor_id: int, alert: str, battery_level: float, last_seen: str):
+        self.sensor_id = sensor_id
+        self.alert = alert
+        self.battery_level = battery_level
+        self.last_seen = last_seen
+
+    def to_bytes(self):
+        return json.dumps({"sensor_id": self.sensor_id, "alert": self.alert, "battery_level": self.battery_level,
+                           "last_seen": self.last_seen}, separators=(",", ":")).encode()
+
+# Resposta de replace_latest quan no ha substituït la lectura perquè Redis ja en té una de més nova
+STALE = -1
+
+def track_battery(pipe, latest: dict, redelivered: Collection[Tuple[int, str]] = ()) -> List[AlertMessage]:
+    # latest: id del sensor -> (puntuació de last_seen, lectura). Afegeix al pipeline, per a cada sensor, la substitució de
+    # l'última lectura i l'entrada o la sortida del conjunt en un sol pas. L'última escriptura guanya, excepte per a les lectures
+    # de redelivered (id, last_seen), que no fan res si la lectura guardada és més nova.
+    # Retorna els avisos possibles, en el mateix ordre que les ordres afegides
+    candidates = []
+    for sensor_id, (score, sensor_data) in latest.items():
+        low = sensor_data["battery_level"] < settings.low_battery_threshold
+        pipe.replace_latest(latest_key(sensor_id), score, {key: value for key, value in sensor_data.items() if value is not None},
+                            LOW_BATTERY_KEY, sensor_id, low, only_if_newer=(sensor_id, sensor_data["last_seen"]) in redelivered)
+        candidates.append(AlertMessage(sensor_id, BATTERY_LOW if low else BATTERY_OK, sensor_data["battery_level"], sensor_data["last_seen"]))
+    return candidates
+
+def transitions(candidates: List[AlertMessage], results: list) -> List[AlertMessage]:
+    # Només els sensors que han canviat d'estat
+    return [alert for alert, result in zip(candidates, results) if result == 1]
+
+def accepted(candidates: List[AlertMessage], results: list) -> List[AlertMessage]:
+    # Els sensors amb la lectura substituïda a Redis
+    return [alert for alert, result in zip(candidates, results) if result != STALE]
+
+def publish(publisher, alerts: List[AlertMessage]):
+    for alert in alerts:
+        if not publisher.publish(alert):
+            print(f"Alert {alert.alert} for sensor {alert.sensor_id} dropped: the publisher buffer is full")
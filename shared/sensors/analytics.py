@@ -0,0 +1,108 @@
+from typing import Optional
+
+from shared.mongodb_client import MongoDBClient
+from shared.timescale import Timescale
+
+# Analítica de tota la flota en una sola consulta a TimescaleDB: agrupa les lectures de l'interval per sensor, hi creua el tipus
+# de la taula sensor_meta i calcula amb funcions de finestra les mitjanes de cada tipus, la puntuació z de cada sensor
+# respecte als sensors del seu tipus i el rànquing dels més calents
+
+FLEET_QUERY = """
+    WITH per_sensor AS (
+        SELECT d.id,
+               COALESCE(m.type, 'unknown') AS type,
+               COUNT(*) AS readings,
+               AVG(d.temperature) AS temperature,
+               MAX(d.temperature) AS max_temperature,
+               AVG(d.humidity) AS humidity,
+               AVG(d.velocity) AS velocity,
+               MIN(d.battery_level) AS min_battery_level
+        FROM sensor_data d
+        LEFT JOIN sensor_meta m ON m.id = d.id
+        WHERE {conditions}
+        GROUP BY d.id, m.type
+    )
+    SELECT id, type, readings, temperature, max_temperature, humidity, velocity, min_battery_level,
+           COUNT(*) OVER w AS type_sensors,
+           CAST(SUM(readings) OVER w AS integer) AS type_readings,
+           AVG(temperature) OVER w AS type_temperature,
+           AVG(humidity) OVER w AS type_humidity,
+           AVG(velocity) OVER w AS type_velocity,
+           (temperature - AVG(temperature) OVER w) / NULLIF(STDDEV_POP(temperature) OVER w, 0) AS temperature_z,
+           (velocity - AVG(velocity) OVER w) / NULLIF(STDDEV_POP(velocity) OVER w, 0) AS velocity_z,
+           RANK() OVER (ORDER BY max_temperature DESC NULLS LAST) AS hottest_rank
+    FROM per_sensor
+    WINDOW w AS (PARTITION BY type)
+    ORDER BY id;
+"""
+
+SENSOR_FIELDS = ("id", "type", "readings", "temperature", "max_temperature", "humidity", "velocity", "min_battery_level", "temperature_z", "velocity_z")
+
+def fleet_summary(timescale: Timescale, from_date: Optional[str] = None, to_date: Optional[str] = None, top: int = 5, z_threshold: float = 2.0) -> dict:
+    conditions, parameters = ["TRUE"], []
+    if from_date is not None:
+        conditions.append("d.last_seen >= %s")
+        parameters.append(from_date)
+    if to_date is not None:
+        conditions.append("d.last_seen <= %s")
+        parameters.append(to_date)
+    timescale.execute(FLEET_QUERY.format(conditions=" AND ".join(conditions)), parameters)
+    cursor = timescale.getCursor()
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # Les columnes de finestra tenen el mateix valor a totes les files d'un tipus
+    types = {}
+    for row in rows:
+        types.setdefault(row["type"], {
+            "type": row["type"],
+            "sensors": row["type_sensors"],
+            "readings": row["type_readings"],
+            "temperature": row["type_temperature"],
+            "humidity": row["type_humidity"],
+            "velocity": row["type_velocity"],
+        })
+    hottest = sorted((row for row in rows if row["max_temperature"] is not None and row["hottest_rank"] <= top),
+                     key=lambda row: (row["hottest_rank"], row["id"]))
+    anomalies = [{"id": row["id"], "type": row["type"], "metric": metric, "value": row[metric], "z": row[f"{metric}_z"]}
+                 for row in rows for metric in ("temperature", "velocity")
+                 if row[f"{metric}_z"] is not None and abs(row[f"{metric}_z"]) >= z_threshold]
+    return {
+        "types": sorted(types.values(), key=lambda summary: summary["type"]),
+        "sensors": [{field: row[field] for field in SENSOR_FIELDS} for row in rows],
+        "hottest": [{"id": row["id"], "type": row["type"], "max_temperature": row["max_temperature"]} for row in hottest],
+        "anomalies": anomalies,
+    }
+
+def save_meta(timescale: Timescale, sensors):
+    # sensors: (id, tipus, nom). Idempotent, com els handlers dels esdeveniments que el fan servir
+    rows = list(sensors)
+    if rows:
+        timescale.execute_values("""
+            INSERT INTO sensor_meta (id, type, name)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE
+            SET type = EXCLUDED.type,
+                name = EXCLUDED.name;
+        """, rows)
+    timescale.execute("commit")
+
+def delete_meta(timescale: Timescale, sensor_id: int):
+    timescale.execute(f"DELETE FROM sensor_meta WHERE id = {int(sensor_id)};")
+    timescale.execute("commit")
+
+def backfill_meta(mongodb: MongoDBClient, timescale: Timescale) -> int:
+    # Omple sensor_meta amb els sensors que ja existien abans de la taula
+    mongodb.getDatabase('DB')
+    mongodb.getCollection('sensors')
+    sensors = [(document['id'], document['type'], document.get('name')) for document in mongodb.getDocuments({})]
+    save_meta(timescale, sensors)
+    return len(sensors)
+
+if __name__ == "__main__":
+    from shared import backends
+    timescale = backends.timescale()
+    try:
+        print(f"Copied the metadata of {backfill_meta(backends.mongodb_client(), timescale)} sensors to sensor_meta")
+    finally:
+        timescale.close()
@@ -0,0 +1,189 @@
+"""Arxiu de les lectures antigues de TimescaleDB en fitxers Parquet.
+
+Cada chunk de l'hypertable sensor_data més antic que ARCHIVE_AFTER_DAYS s'exporta a un fitxer Parquet
+(ARCHIVE_URI/sensor_data/year=AAAA/<inici>-<final>-<chunk>.parquet, ordenat per id i last_seen) i després s'elimina de TimescaleDB.
+Una lectura tardana d'un interval ja arxivat crea un chunk nou amb el mateix interval: s'exporta a un altre fitxer (el nom del chunk
+és únic) i el manifest conserva els dos.
+ARCHIVE_URI pot ser un directori local o un URI de pyarrow, per exemple s3://bucket/prefix?endpoint_override=minio:9000&scheme=http.
+El manifest (sensor_data/_manifest.json) llista els fitxers i el límit: les lectures anteriors ja no són a TimescaleDB.
+
+    python -m shared.sensors.archive          # cada ARCHIVE_INTERVAL segons
+    python -m shared.sensors.archive --once
+
+Cal pyarrow (pip install pyarrow), que no és a requirements.txt: la imatge alpine no en té wheels.
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+from typing import List, Optional
+
+from shared.sensors import timeseries
+from shared.settings import settings
+from shared.timescale import Timescale
+
+try:
+    import pyarrow
+    import pyarrow.fs
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TABLE = "sensor_data"
+MANIFEST = f"{TABLE}/_manifest.json"
+COLUMNS = ("id", "temperature", "humidity", "velocity", "battery_level", "last_seen")
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S"
+# Segons que es guarda el manifest llegit a cada procés de l'API
+MANIFEST_TTL = 60
+
+_manifest_cache = (0.0, None)
+
+def enabled() -> bool:
+    return bool(settings.archive_uri)
+
+def _filesystem():
+    if pyarrow is None:
+        raise RuntimeError("The sensor_data archive needs pyarrow: pip install pyarrow")
+    uri = settings.archive_uri
+    if "://" not in uri:
+        uri = os.path.abspath(uri)
+    return pyarrow.fs.FileSystem.from_uri(uri)
+
+def _schema():
+    return pyarrow.schema([
+        ("id", pyarrow.int32()),
+        ("temperature", pyarrow.float64()),
+        ("humidity", pyarrow.float64()),
+        ("velocity", pyarrow.float64()),
+        ("battery_level", pyarrow.float64()),
+        ("last_seen", pyarrow.timestamp("us")),
+    ])
+
+def read_manifest(fs=None, base=None) -> dict:
+    if fs is None:
+        fs, base = _filesystem()
+    try:
+        with fs.open_input_stream(f"{base}/{MANIFEST}") as stream:
+            return json.loads(stream.read())
+    except FileNotFoundError:
+        return {"boundary": None, "files": []}
+
+def _write_manifest(fs, base, manifest: dict):
+    # Escrivim un fitxer nou i el movem a sobre de l'anterior: els lectors mai veuen un manifest a mitges
+    path = f"{base}/{MANIFEST}"
+    with fs.open_output_stream(path + ".tmp") as stream:
+        stream.write(json.dumps(manifest, indent=1).encode())
+    fs.move(path + ".tmp", path)
+
+def manifest(refresh: bool = False) -> Optional[dict]:
+    # Manifest en memòria cau durant MANIFEST_TTL segons (None si no hi ha arxiu)
+    global _manifest_cache
+    loaded_at, cached = _manifest_cache
+    if refresh or time.monotonic() - loaded_at > MANIFEST_TTL:
+        cached = read_manifest() if enabled() else None
+        _manifest_cache = (time.monotonic(), cached)
+    return cached
+
+def _before_boundary(current: Optional[dict], start: datetime.datetime) -> bool:
+    return bool(current and current["boundary"]) and start < datetime.datetime.fromisoformat(current["boundary"])
+
+def covers(from_date: str) -> bool:
+    # Cert si part de l'interval que comença a from_date és a l'arxiu. Si l'interval és prou antic per haver-se arxivat
+    # després de llegir el manifest, el tornem a llegir: així no es perden les lectures d'un chunk acabat d'eliminar
+    start = timeseries.parse_timestamp(from_date)
+    if _before_boundary(manifest(), start):
+        return True
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=settings.archive_after_days)
+    return start < cutoff and _before_boundary(manifest(refresh=True), start)
+
+def read_readings(sensor_id: int, start: datetime.datetime, end: datetime.datetime) -> List[dict]:
+    # Llegeix les lectures arxivades d'un sensor entre start i end. Només els fitxers que se solapen amb l'interval,
+    # només les columnes que calen i, amb els fitxers locals, amb memory map: el sistema operatiu només llegeix les pàgines
+    # dels row groups que passen el filtre (els fitxers estan ordenats per id). Els fitxers van en l'ordre del manifest: si una lectura
+    # és a dos fitxers del mateix interval, l'última és la del chunk arxivat més tard
+    fs, base = _filesystem()
+    readings = []
+    for entry in manifest()["files"]:
+        if datetime.datetime.fromisoformat(entry["end"]) <= start or datetime.datetime.fromisoformat(entry["start"]) > end:
+            continue
+        table = pyarrow.parquet.read_table(f"{base}/{entry['path']}", filesystem=fs, memory_map=True,
+                                           columns=["id", "temperature", "humidity", "velocity", "last_seen"],
+                                           filters=[("id", "=", sensor_id), ("last_seen", ">=", start), ("last_seen", "<=", end)])
+        readings.extend(table.to_pylist())
+    return readings
+
+def _chunks(timescale: Timescale, cutoff: datetime.datetime) -> list:
+    timescale.execute("SET LOCAL TIME ZONE 'UTC'")
+    timescale.execute("""
+        SELECT chunk_schema, chunk_name, range_start::timestamp, range_end::timestamp
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = %s AND range_end::timestamp <= %s
+        ORDER BY range_start;
+    """, (TABLE, cutoff))
+    return timescale.getCursor().fetchall()
+
+def archive_chunk(timescale: Timescale, fs, base, current: dict, chunk) -> int:
+    schema, name, start, end = chunk
+    # Bloqueja les escriptures al chunk fins que s'hagi eliminat: una lectura tardana no es pot perdre entre l'exportació i el DROP
+    timescale.execute(f'LOCK TABLE "{schema}"."{name}" IN SHARE MODE')
+    timescale.execute(f'SELECT {", ".join(COLUMNS)} FROM "{schema}"."{name}" ORDER BY id, last_seen')
+    rows = timescale.getCursor().fetchall()
+    table = pyarrow.Table.from_pydict({column: [row[i] for row in rows] for i, column in enumerate(COLUMNS)}, schema=_schema())
+    path = f"{TABLE}/year={start:%Y}/{start.strftime(TIMESTAMP_FORMAT)}-{end.strftime(TIMESTAMP_FORMAT)}-{name}.parquet"
+    fs.create_dir(f"{base}/{TABLE}/year={start:%Y}", recursive=True)
+    pyarrow.parquet.write_table(table, f"{base}/{path}.tmp", filesystem=fs, row_group_size=65536)
+    fs.move(f"{base}/{path}.tmp", f"{base}/{path}")
+    # El manifest s'actualitza abans d'eliminar el chunk. Si el DROP falla les lectures són als dos llocs fins al següent intent,
+    # i get_data es queda la de TimescaleDB. Només se substitueix l'entrada del mateix chunk (un intent anterior que no l'ha eliminat)
+    current["files"] = [entry for entry in current["files"] if entry["path"] != path]
+    current["files"].append({"path": path, "start": start.isoformat(), "end": end.isoformat(), "rows": len(rows)})
+    current["boundary"] = max(entry["end"] for entry in current["files"])
+    _write_manifest(fs, base, current)
+    timescale.execute("SELECT drop_chunks(%s, older_than => %s::timestamp, newer_than => %s::timestamp)", (TABLE, end, start))
+    timescale.execute("commit")
+    return len(rows)
+
+def run_once(timescale: Timescale, now: Optional[datetime.datetime] = None) -> int:
+    # Arxiva tots els chunks més antics que ARCHIVE_AFTER_DAYS. Retorna el nombre de chunks arxivats
+    fs, base = _filesystem()
+    cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=settings.archive_after_days)
+    # Un sol arxivador alhora: el manifest no admet escriptures concurrents
+    timescale.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (f"{TABLE}_archive",))
+    if not timescale.getCursor().fetchone()[0]:
+        timescale.execute("rollback")
+        return 0
+    try:
+        chunks = _chunks(timescale, cutoff)
+        timescale.execute("commit")
+        current = read_manifest(fs, base)
+        for chunk in chunks:
+            try:
+                rows = archive_chunk(timescale, fs, base, current, chunk)
+            except Exception:
+                timescale.execute("rollback")
+                raise
+            print(f"Archived {rows} readings of chunk {chunk[1]} ({chunk[2]} - {chunk[3]})")
+        return len(chunks)
+    finally:
+        timescale.execute("SELECT pg_advisory_unlock(hashtext(%s))", (f"{TABLE}_archive",))
+        timescale.execute("commit")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old sensor_data chunks to Parquet")
+    parser.add_argument("--once", action="store_true", help="archive the pending chunks and exit")
+    args = parser.parse_args(argv)
+    if not enabled():
+        raise SystemExit("Set ARCHIVE_URI to enable the sensor_data archive")
+    while True:
+        timescale = Timescale()
+        try:
+            run_once(timescale)
+        finally:
+            timescale.close()
+        if args.once:
+            return
+        time.sleep(settings.archive_interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from shared.redis_client import RedisClient
+from shared.mongodb_client import MongoDBClient
+from shared.elasticsearch_client import ElasticsearchClient
+from shared.cassandra_client import CassandraClient
+from shared.timescale import Timescale
+from shared.sensors import analytics
+from shared.sensors.keys import latest_key, recent_key, recent_since_key, LOW_BATTERY_KEY
+
+# Esdeveniments que es propaguen des de PostgreSQL a la resta de bases de dades a través de l'outbox
+SENSOR_CREATED = "sensor_created"
+SENSOR_DELETED = "sensor_deleted"
+
+# Tots els handlers són idempotents: aplicar el mateix esdeveniment més d'una vegada deixa les bases de dades igual
+
+def sensor_created(payload: dict, mongodb: MongoDBClient, elastic: ElasticsearchClient, cassandra: CassandraClient, timescale: Timescale, **_):
+    #Guarda el document del sensor a mongoDB
+    mongodb.getDatabase('DB')
+    collection = mongodb.getCollection('sensors')
+    collection.create_index([("location", "2dsphere")])
+    mongodb.upsertDocument({"id": payload["id"]}, payload)
+    #Indexem els camps nom, descripció i tipus de sensor a l'índex extern fent servir l'id del sensor com a id del document
+    data = {
+        'name': payload['name'],
+        'type': payload['type'],
+        'description': payload['description']
+    }
+    elastic.index_document('sensors', data, id=payload['id'])
+    #Guardem el id i el tipus del sensor a la taula quantity de cassandra
+    cassandra.execute(f"INSERT INTO sensor.quantity(id, type) VALUES ({payload['id']}, '{payload['type']}');")
+    #Guardem el tipus i el nom a sensor_meta de TimescaleDB per a les consultes d'analítica
+    analytics.save_meta(timescale, [(payload['id'], payload['type'], payload['name'])])
+
+def sensor_deleted(payload: dict, mongodb: MongoDBClient, redis: RedisClient, timescale: Timescale, **_):
+    #Elimina el document de mongoDB
+    mongodb.getDatabase('DB')
+    mongodb.getCollection('sensors')
+    mongodb.deleteDocument({"id": payload["id"]})
+    #Elimina les claus de redis
+    redis.delete(latest_key(payload["id"]), recent_key(payload["id"]), recent_since_key(payload["id"]))
+    redis.srem(LOW_BATTERY_KEY, payload["id"])
+    analytics.delete_meta(timescale, payload["id"])
+
+HANDLERS = {
+    SENSOR_CREATED: sensor_created,
+    SENSOR_DELETED: sensor_deleted,
+}
+
+def apply_event(event_type: str, payload: dict, **clients):
+    # clients: mongodb, elastic, cassandra, redis i timescale. Cada handler només fa servir els que necessita
+    HANDLERS[event_type](payload, **clients)
@@ -0,0 +1,22 @@
+# Claus de Redis dels sensors
+
+# Espai de noms de les claus de Redis dels sensors
+SENSOR_NAMESPACE = "sensor"
+
+# Conjunt dels sensors amb la bateria per sota del llindar, mantingut en enregistrar les lectures
+LOW_BATTERY_KEY = f"{SENSOR_NAMESPACE}:low_battery"
+
+# Canal de Redis on es publiquen les lectures noves per als clients subscrits en directe
+LIVE_CHANNEL = f"{SENSOR_NAMESPACE}:live"
+
+def latest_key(sensor_id: int) -> str:
+    return f"{SENSOR_NAMESPACE}:{sensor_id}:latest"
+
+def recent_key(sensor_id: int) -> str:
+    return f"{SENSOR_NAMESPACE}:{sensor_id}:recent"
+
+def recent_since_key(sensor_id: int) -> str:
+    return f"{SENSOR_NAMESPACE}:{sensor_id}:recent_since"
+
+def seen_key(sensor_id: int, last_seen: str) -> str:
+    return f"{SENSOR_NAMESPACE}:{sensor_id}:seen:{last_seen}"
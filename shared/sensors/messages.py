@@ -0,0 +1,32 @@
+import json
+
+from shared import wire
+from shared.sensors import models, schemas
+
+# Missatges que es publiquen a la cua. Cada missatge indica el seu content type i sap codificar-se
+SENSOR_DATA = wire.SENSOR_DATA
+
+# Lectura d'un sensor en format binari: el publicador pot empaquetar-ne moltes en un sol missatge
+class SensorDataMessage:
+    content_type = wire.READINGS_CONTENT_TYPE
+
+    def __init__(self, sensor_id: int, data: schemas.SensorData):
+        self.sensor_id = sensor_id
+        self.data = data
+
+    def to_bytes(self):
+        return wire.encode_readings([(self.sensor_id, self.data.dict())])
+
+# Esdeveniment de l'outbox que el relay publica perquè el consumidor el propagui
+class OutboxMessage:
+    content_type = wire.JSON_CONTENT_TYPE
+
+    def __init__(self, event: models.Outbox):
+        self.event_id = event.id
+        # Els esdeveniments d'un sensor van a la mateixa cua que les seves lectures
+        self.sensor_id = event.payload["id"]
+        self.type = event.event_type
+        self.payload = event.payload
+
+    def to_bytes(self):
+        return json.dumps({"event_id": self.event_id, "type": self.type, "payload": self.payload}, separators=(",", ":")).encode()
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy import JSON, Column, DateTime, Integer, String
 from shared.database import Base
 
 class Sensor(Base):
@@ -10,4 +10,13 @@ class Sensor(Base):
     #type = Column(String, default="Dummy")
     #mac_address = Column(String,unique=True, index=True)
     #latitude = Column(Float)
-    #longitude = Column(Float)
\ No newline at end of file
+    #longitude = Column(Float)
+
+# Esdeveniments pendents de propagar a la resta de bases de dades. S'escriuen a la mateixa transacció que el canvi a PostgreSQL
+class Outbox(Base):
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    dispatched_at = Column(DateTime, nullable=True)
@@ -0,0 +1,71 @@
+import datetime
+import time
+
+from sqlalchemy.orm import Session
+
+from shared import backends
+from shared.database import SessionLocal
+from shared.publisher import Publisher
+from shared.sensors import events, models
+from shared.sensors.messages import OutboxMessage
+from shared.settings import settings
+
+# Patró outbox: els canvis de PostgreSQL i l'esdeveniment per propagar-los a la resta de bases de dades
+# es guarden a la mateixa transacció. El relay publica els esdeveniments pendents a la cua i el consumidor els aplica.
+
+def add_event(db: Session, event_type: str, payload: dict) -> models.Outbox:
+    # Afegeix l'esdeveniment a la sessió: es guarda quan es faci commit del canvi que el genera
+    event = models.Outbox(event_type=event_type, payload=payload)
+    db.add(event)
+    return event
+
+def dispatch_inline(db: Session, event: models.Outbox, **clients) -> bool:
+    # Aplica l'esdeveniment directament. Si falla el deixem pendent perquè el relay el torni a intentar
+    try:
+        events.apply_event(event.event_type, event.payload, **clients)
+    except Exception as e:
+        print(f"Outbox event {event.id} left pending for the relay: {e!r}")
+        return False
+    event.dispatched_at = datetime.datetime.utcnow()
+    db.commit()
+    return True
+
+def relay(db: Session, publisher: Publisher, batch_size: int = 100, timeout: float = 30) -> int:
+    # Publica un lot d'esdeveniments pendents. SKIP LOCKED permet tenir diversos relays en paral·lel
+    pending = (db.query(models.Outbox)
+               .filter(models.Outbox.dispatched_at.is_(None))
+               .order_by(models.Outbox.id)
+               .limit(batch_size)
+               .with_for_update(skip_locked=True)
+               .all())
+    published = []
+    for event in pending:
+        if not publisher.publish(OutboxMessage(event)):
+            break
+        published.append(event)
+    # Només els marquem com a enviats quan el broker els ha confirmat. Si no, es tornaran a publicar (els handlers són idempotents)
+    if not publisher.flush(timeout):
+        db.rollback()
+        return 0
+    for event in published:
+        event.dispatched_at = datetime.datetime.utcnow()
+    db.commit()
+    return len(published)
+
+def run(poll_interval: float = 1.0, batch_size: int = 100):
+    publisher = backends.publisher(shards=settings.queue_shards, max_length=settings.queue_max_length, overflow=settings.queue_overflow)
+    try:
+        while True:
+            db = SessionLocal()
+            try:
+                published = relay(db, publisher, batch_size)
+            finally:
+                db.close()
+            # Si el lot era complet segur que hi ha més esdeveniments pendents
+            if published < batch_size:
+                time.sleep(poll_interval)
+    finally:
+        publisher.close()
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,42 @@
+import json
+from typing import List, Optional
+
+from shared.redis_client import RedisClient
+from shared.sensors import timeseries
+
+# Les últimes lectures de cada sensor es guarden en un sorted set de Redis amb el timestamp com a puntuació.
+# El conjunt es retalla per rang: les lectures eliminades sempre tenen una puntuació menor que la més antiga que es conserva.
+# Que el buffer tingui una lectura no vol dir que tingui totes les posteriors (les anteriors al desplegament, una escriptura a Redis
+# que ha fallat després del commit de TimescaleDB, una lectura endarrerida): una marca per sensor (recent_since) diu des de quin
+# timestamp el buffer té segur totes les lectures. Es posa amb la primera lectura que hi passa i s'esborra si una escriptura falla.
+
+def add_reading(pipe, key: str, sensor_data: dict, max_readings: int):
+    # Afegeix la lectura al pipeline. Si ja n'hi havia una amb el mateix timestamp la substitueix, com l'ON CONFLICT de TimescaleDB
+    score = timeseries.to_score(sensor_data["last_seen"])
+    pipe.zremrangebyscore(key, score, score)
+    pipe.zadd(key, {json.dumps(sensor_data, separators=(",", ":")): score})
+    pipe.zremrangebyrank(key, 0, -(max_readings + 1))
+
+def mark_covered(pipe, since_key: str, score: float):
+    # Afegeix al pipeline la marca de cobertura si el sensor encara no en té: a partir d'aquesta lectura totes passen pel buffer
+    pipe.set(since_key, score, nx=True)
+
+def get_window(redis: RedisClient, key: str, since_key: str, from_date: str, to_date: str, max_readings: int) -> Optional[List[dict]]:
+    # Retorna les lectures entre from_date i to_date, o None si no és segur que el buffer les tingui totes
+    try:
+        from_score = timeseries.to_score(from_date)
+        to_score = timeseries.to_score(to_date)
+    except ValueError:
+        return None
+    pipe = redis.pipeline(transaction=True)
+    pipe.get(since_key)
+    pipe.zcard(key)
+    pipe.zrange(key, 0, 0, withscores=True)
+    pipe.zrangebyscore(key, from_score, to_score)
+    since, count, oldest, members = pipe.execute()
+    if since is None or float(since) > from_score:
+        return None
+    # Si el buffer s'ha retallat, les lectures anteriors a la més antiga que queda ja no hi són
+    if count >= max_readings and oldest[0][1] > from_score:
+        return None
+    return [json.loads(member) for member in members]
@@ -1,35 +1,95 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Collection, List, Optional, Tuple
 
-from . import models, schemas
+from . import models, schemas, recent, timeseries, events, outbox, alerts, stream, analytics, archive
+from .keys import latest_key, recent_key, recent_since_key, LOW_BATTERY_KEY, LIVE_CHANNEL
 from shared.redis_client import RedisClient
 from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient
 from shared.cassandra_client import CassandraClient
 from shared.timescale import Timescale
+from shared import database
+from shared.settings import settings
 import json
+import datetime
+
+# Camps de l'última lectura d'un sensor que guardem al hash de Redis
+SENSOR_DATA_FIELDS = ("velocity", "temperature", "humidity", "battery_level", "last_seen")
+
+def _decode_latest(fields, values) -> dict:
+    # Redis retorna bytes: els convertim al tipus original de cada camp (None si el camp no hi és)
+    sensor_data = {}
+    for field, value in zip(fields, values):
+        if value is None:
+            sensor_data[field] = None
+        elif field == "last_seen":
+            sensor_data[field] = value.decode()
+        else:
+            sensor_data[field] = float(value)
+    return sensor_data
+
+def get_latest_data(redis: RedisClient, sensor_ids: List[int], fields: Optional[List[str]] = None) -> List[Optional[dict]]:
+    # Llegeix l'última lectura de tots els sensors en un sol pipeline. Si no es demanen camps concrets es llegeix el hash sencer.
+    # Amb camps concrets, si el sensor té lectura es decideix amb EXISTS i no amb els valors: tots els camps demanats poden ser nuls
+    pipe = redis.pipeline(transaction=False)
+    for sensor_id in sensor_ids:
+        if fields:
+            pipe.exists(latest_key(sensor_id))
+            pipe.hmget(latest_key(sensor_id), fields)
+        else:
+            pipe.hgetall(latest_key(sensor_id))
+    replies = pipe.execute()
+    if fields:
+        return [_decode_latest(fields, values) if exists else None for exists, values in zip(replies[::2], replies[1::2])]
+    results = []
+    for values in replies:
+        if not values:
+            results.append(None)
+        else:
+            values = {key.decode(): value for key, value in values.items()}
+            results.append(_decode_latest(SENSOR_DATA_FIELDS, [values.get(field) for field in SENSOR_DATA_FIELDS]))
+    return results
+
+def get_latest_sensors_data(redis: RedisClient, sensor_ids: List[int], fields: Optional[List[str]] = None) -> List[dict]:
+    if fields:
+        unknown = [field for field in fields if field not in SENSOR_DATA_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    sensors = []
+    #Afegeix l'identificador a les dades dels sensors que tenen alguna lectura
+    for sensor_id, sensor_data in zip(sensor_ids, get_latest_data(redis, sensor_ids, fields)):
+        if sensor_data is not None:
+            sensors.append({"id": sensor_id, **sensor_data})
+    return sensors
+
+def _first_from_replica(db: Session, query) -> Optional[models.Sensor]:
+    # Si la rèplica no el troba, potser és un sensor que una altra petició acaba de crear i encara no s'hi ha replicat:
+    # el tornem a buscar al primari
+    with database.replica(db) as from_replica:
+        sensor = query.first()
+    if sensor is None and from_replica:
+        sensor = query.first()
+    return sensor
 
 def get_sensor(db: Session, sensor_id: int) -> Optional[models.Sensor]:
-    return db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
+    return _first_from_replica(db, db.query(models.Sensor).filter(models.Sensor.id == sensor_id))
 
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
-    return db.query(models.Sensor).filter(models.Sensor.name == name).first()
+    return _first_from_replica(db, db.query(models.Sensor).filter(models.Sensor.name == name))
 
 def get_sensors(db: Session, skip: int = 0, limit: int = 100) -> List[models.Sensor]:
-    return db.query(models.Sensor).offset(skip).limit(limit).all()
+    # Sense tornar a provar al primari: un sensor creat des d'un altre procés pot no sortir al llistat fins que s'hagi replicat
+    with database.replica(db):
+        return db.query(models.Sensor).offset(skip).limit(limit).all()
 
-def create_sensor(db: Session, sensor: schemas.SensorCreate, mongoDB: MongoDBClient,elastic:ElasticsearchClient,cassandra:CassandraClient) -> models.Sensor:
-    #Crea el sensor i l'emmagatzema a PostgreSQL
+def create_sensor(db: Session, sensor: schemas.SensorCreate, mongoDB: MongoDBClient,elastic:ElasticsearchClient,cassandra:CassandraClient,timescale:Timescale) -> models.Sensor:
+    #Crea el sensor a PostgreSQL. El flush ens dona l'id sense tancar la transacció
     db_sensor = models.Sensor(name=sensor.name)
     db.add(db_sensor)
-    db.commit()
-    db.refresh(db_sensor)
-    #Accedeix a la base de dades DB i a la col·lecció Sensors
-    mongoDB.getDatabase('DB')
-    collection=mongoDB.getCollection('sensors')
+    db.flush()
 
-    #Crea el document amb la informació del sensor
+    #Crea el document amb la informació del sensor per a la resta de bases de dades
     document = {
         "id": db_sensor.id,
         "name": sensor.name,
@@ -47,78 +107,106 @@ def create_sensor(db: Session, sensor: schemas.SensorCreate, mongoDB: MongoDBCli
         },
         "description": sensor.description
     }
-
-    # Crea un índex per la ubicació
-    collection.create_index([("location","2dsphere")])
-
-    #Afegeix el document a mongoDB
-    mongoDB.insertDocument(document)
-    #Indexem els camps nom, descripció i tipus de sensor a l'índex extern
-    data = {
-        'name': sensor.name,
-        'type': sensor.type,
-        'description': sensor.description
-    }
-    elastic.index_document('sensors', data)
-    #Guardem el id i el tipus del sensor a la taula quantity de cassandra
-    query = f"INSERT INTO sensor.quantity(id, type) VALUES ({db_sensor.id}, '{sensor.type}');"
-    cassandra.execute(query)
+    #Guarda el sensor i l'esdeveniment de l'outbox en un sol commit
+    event = outbox.add_event(db, events.SENSOR_CREATED, document)
+    db.commit()
+    #Propaga el sensor a mongoDB, Elasticsearch, Cassandra i TimescaleDB. Si no es fa aquí ho farà el relay de l'outbox
+    if settings.outbox_inline_dispatch:
+        outbox.dispatch_inline(db, event, mongodb=mongoDB, elastic=elastic, cassandra=cassandra, timescale=timescale)
 
     #Afegim l'id   
     result=sensor.dict()
-    result['id']=db_sensor.id
+    result['id']=document['id']
     return result
 
 
-def record_data(redis: RedisClient, sensor_id: int, data: schemas.SensorData,timescale:Timescale,cassandra:CassandraClient) -> schemas.Sensor:
-    # Crea un diccionari amb les dades del sensor
-    sensor_data={
-        "velocity":data.velocity,
-        "temperature": data.temperature,
-        "humidity":data.humidity,
-        "battery_level":data.battery_level,
-        "last_seen":data.last_seen
-    }
-    #Transformem les dades per a que puguin ser inserides a la query de SQL, ja que no accepta None i ho hem de substituir per Null        
-    ts_data = {key: value if value is not None else 'NULL' for key, value in sensor_data.items()}
-    ts_data['last_seen'] = f"'{ts_data['last_seen']}'"
-    
-    # Afegeix les dades a TimescaleDB
-    timescale_query = f"""
-    INSERT INTO sensor_data (id, temperature, humidity, velocity, battery_level, last_seen) 
-    VALUES ({sensor_id}, {ts_data['temperature']}, {ts_data['humidity']}, {ts_data['velocity']}, {ts_data['battery_level']}, {ts_data['last_seen']})
-    ON CONFLICT (id, last_seen) DO UPDATE 
-    SET temperature = EXCLUDED.temperature,
-        humidity = EXCLUDED.humidity,
-        velocity = EXCLUDED.velocity,
-        battery_level = EXCLUDED.battery_level;
-    """
-    timescale.execute(timescale_query)
+def record_data(redis: RedisClient, sensor_id: int, data: schemas.SensorData,timescale:Timescale,cassandra:CassandraClient,publisher=None) -> schemas.Sensor:
+    changes = record_data_batch(redis=redis, readings=[(sensor_id, data)], timescale=timescale, cassandra=cassandra)
+    #Publica els canvis de bateria baixa a la cua d'avisos
+    if changes and publisher is not None:
+        alerts.publish(publisher, changes)
+    return data
+
+def record_data_batch(redis: RedisClient, readings: List[Tuple[int, schemas.SensorData]], timescale: Timescale, cassandra: CassandraClient,
+                      redelivered: Collection[Tuple[int, str]] = ()) -> List[alerts.AlertMessage]:
+    # Escriu un lot de lectures. Totes les lectures es guarden a TimescaleDB, a la taula de temperatura de cassandra i al buffer
+    # de lectures recents, però a l'última lectura de Redis i a la taula de bateria només cal escriure-hi la més nova de cada sensor.
+    # redelivered: (id, last_seen) de les lectures que el consumidor torna a processar; no substitueixen una lectura més nova.
+    # Retorna els avisos dels sensors que han entrat o sortit del conjunt de bateria baixa
+    rows = {}
+    latest = {}
+    for sensor_id, data in readings:
+        # Crea un diccionari amb les dades del sensor
+        sensor_data = {
+            "velocity": data.velocity,
+            "temperature": data.temperature,
+            "humidity": data.humidity,
+            "battery_level": data.battery_level,
+            "last_seen": data.last_seen
+        }
+        # Un INSERT ... ON CONFLICT no pot modificar la mateixa fila dues vegades: ens quedem l'última lectura de cada (id, last_seen)
+        rows[(sensor_id, data.last_seen)] = (sensor_id, data.temperature, data.humidity, data.velocity, data.battery_level, data.last_seen)
+        score = timeseries.to_score(data.last_seen)
+        if sensor_id not in latest or score >= latest[sensor_id][0]:
+            latest[sensor_id] = (score, sensor_data)
+
+    # Afegeix les dades a TimescaleDB en una sola consulta
+    timescale.execute_values("""
+        INSERT INTO sensor_data (id, temperature, humidity, velocity, battery_level, last_seen)
+        VALUES %s
+        ON CONFLICT (id, last_seen) DO UPDATE
+        SET temperature = EXCLUDED.temperature,
+            humidity = EXCLUDED.humidity,
+            velocity = EXCLUDED.velocity,
+            battery_level = EXCLUDED.battery_level;
+    """, list(rows.values()))
     timescale.execute("commit")
 
+    pipe = redis.pipeline()
+    # Guarda l'última lectura de cada sensor al seu hash i actualitza el conjunt de sensors amb bateria baixa. Si és un reintent i
+    # Redis ja té una lectura més nova no es toca res. Les primeres respostes del pipeline diuen quins sensors han canviat
+    candidates = alerts.track_battery(pipe, latest, redelivered)
+    # Afegeix les lectures al buffer de lectures recents per servir consultes de finestres curtes sense anar a TimescaleDB
+    for sensor_id, data in readings:
+        recent.add_reading(pipe, recent_key(sensor_id), data.dict(), settings.redis_recent_readings)
+    for sensor_id, (score, _) in latest.items():
+        recent.mark_covered(pipe, recent_since_key(sensor_id), score)
+    # Publica les lectures del lot en un sol missatge per als clients subscrits en directe
+    pipe.publish(LIVE_CHANNEL, stream.live_message((sensor_id, data.dict()) for sensor_id, data in readings))
+    try:
+        results = pipe.execute()[:len(candidates)]
+    except Exception:
+        # Les lectures ja són a TimescaleDB però no al buffer: el buffer d'aquests sensors deixa de cobrir res fins a la lectura següent
+        try:
+            redis.delete(*[recent_since_key(sensor_id) for sensor_id in latest])
+        except Exception as e:
+            print(f"Could not invalidate the recent readings of {list(latest)}: {e!r}")
+        raise
+
     #Si el sensor té dades de temperatura les guardem a la taula de temperatura de cassandra
-    if data.temperature is not None:
-        query=f"""
-            INSERT INTO sensor.temperature
-            (id, temperature)
-            VALUES ({sensor_id}, {data.temperature});
-            """
-        cassandra.execute(query)
-    #Guardem el nivell de bateria a la taula bateria de cassandra
-    query=f"""
-        INSERT INTO sensor.battery
-        (id, battery_level)
-        VALUES ({sensor_id}, {data.battery_level});
-        """
-    cassandra.execute(query)
-    # Passa les dades a JSON i les emmagatzema a Redis 
-    redis.set(sensor_id, json.dumps(sensor_data))
-    return data
+    queries = []
+    for sensor_id, data in readings:
+        if data.temperature is not None:
+            queries.append(f"""
+                INSERT INTO sensor.temperature
+                (id, temperature)
+                VALUES ({sensor_id}, {data.temperature});
+                """)
+    #Guardem l'últim nivell de bateria de cada sensor a la taula bateria de cassandra, si s'ha substituït l'última lectura
+    for alert in alerts.accepted(candidates, results):
+        queries.append(f"""
+            INSERT INTO sensor.battery
+            (id, battery_level)
+            VALUES ({alert.sensor_id}, {alert.battery_level});
+            """)
+    # Totes les escriptures del lot s'envien alhora i només s'espera una vegada que acabin
+    cassandra.execute_concurrent(queries)
+    return alerts.transitions(candidates, results)
 
 def get_data(redis: RedisClient, sensor_id: int,sensor_name:str,timescale:Timescale,from_date:str,to_date:str,bucket:str) -> schemas.Sensor:
     if from_date is None and to_date is None and bucket is None:
         #Obté les dades del sensor de Redis
-        db_sensordata = json.loads(redis.get(sensor_id))
+        db_sensordata = get_latest_data(redis, [sensor_id])[0]
 
         #Si no les troba llança una excepció
         if db_sensordata is None:
@@ -130,6 +218,14 @@ def get_data(redis: RedisClient, sensor_id: int,sensor_name:str,timescale:Timesc
 
         return db_sensordata
     else:
+        # Si el buffer de lectures recents de Redis cobreix tot l'interval, agrupem les lectures sense consultar TimescaleDB
+        if from_date is not None and to_date is not None and bucket in timeseries.BUCKETS:
+            readings = recent.get_window(redis, recent_key(sensor_id), recent_since_key(sensor_id), from_date, to_date, settings.redis_recent_readings)
+            if readings is not None:
+                return timeseries.aggregate_buckets(sensor_id, readings, bucket)
+        # Si l'interval comença abans del límit de l'arxiu, part de les lectures són als fitxers Parquet
+        if from_date is not None and to_date is not None and bucket in timeseries.BUCKETS and archive.enabled() and archive.covers(from_date):
+            return get_archived_data(timescale, sensor_id, from_date, to_date, bucket)
         # Creem la query per obtenir dades del sensor agrupades per intervals de temps
         query = f"""
             SELECT 
@@ -147,6 +243,41 @@ def get_data(redis: RedisClient, sensor_id: int,sensor_name:str,timescale:Timesc
         result = timescale.getCursor().fetchall()
         return result
 
+def get_archived_data(timescale: Timescale, sensor_id: int, from_date: str, to_date: str, bucket: str) -> List[tuple]:
+    # Abans del límit de l'arxiu una lectura pot ser als fitxers Parquet i també a TimescaleDB (les tardanes i les d'un chunk que
+    # no s'ha pogut eliminar): les ajuntem una a una i, si una lectura és als dos llocs, guanya TimescaleDB. Els intervals posteriors
+    # al límit només són a TimescaleDB i els agrupa la base de dades, com a get_data. L'interval que conté el límit s'agrupa amb les
+    # lectures d'abans perquè la mitjana inclogui les dues bandes
+    start, end = timeseries.parse_timestamp(from_date), timeseries.parse_timestamp(to_date)
+    boundary = datetime.datetime.fromisoformat(archive.manifest()["boundary"])
+    split = timeseries.time_bucket(bucket, boundary)
+    if split < boundary:
+        split = timeseries.next_bucket(bucket, split)
+    readings = {reading["last_seen"]: reading for reading in archive.read_readings(sensor_id, start, min(end, split))}
+    timescale.execute("""
+        SELECT id, temperature, humidity, velocity, last_seen
+        FROM sensor_data
+        WHERE id = %s AND last_seen >= %s AND last_seen <= %s AND last_seen < %s;
+    """, (sensor_id, start, end, split))
+    for row in timescale.getCursor().fetchall():
+        readings[row[4]] = dict(zip(("id", "temperature", "humidity", "velocity", "last_seen"), row))
+    rows = timeseries.aggregate_buckets(sensor_id, [{**reading, "last_seen": last_seen.isoformat()} for last_seen, reading in readings.items()], bucket)
+    if split <= end:
+        timescale.execute(f"""
+            SELECT
+                id,
+                time_bucket('1 {bucket}', last_seen) AS {bucket},
+                AVG(velocity) AS velocity,
+                AVG(temperature) AS temperature,
+                AVG(humidity) AS humidity
+            FROM sensor_data
+            WHERE id = %s AND last_seen >= %s AND last_seen <= %s
+            GROUP BY id, {bucket}
+            ORDER BY {bucket};
+        """, (sensor_id, split, end))
+        rows += timescale.getCursor().fetchall()
+    return rows
+
 def delete_sensor(db: Session, sensor_id: int,mongoDB:MongoDBClient,redis:RedisClient,elastic:ElasticsearchClient,timescale:Timescale):
     #Obté el sensor de postgreSQL
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
@@ -155,18 +286,31 @@ def delete_sensor(db: Session, sensor_id: int,mongoDB:MongoDBClient,redis:RedisC
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
     
-    #Elimina el sensor de postgreSQL
+    #Elimina el sensor de postgreSQL i guarda l'esdeveniment de l'outbox en un sol commit
     db.delete(db_sensor)
+    event = outbox.add_event(db, events.SENSOR_DELETED, {"id": sensor_id})
     db.commit()
 
-    #Elimina el document de mongoDB
-    mongoDB.getDatabase('DB')
-    mongoDB.getCollection('sensors')
-    mongoDB.deleteDocument({"id": sensor_id})
-
-    #Elimina la clau de redis
-    redis.delete(sensor_id)
+    #Elimina el document de mongoDB i les claus de redis. Si no es fa aquí ho farà el relay de l'outbox
+    if settings.outbox_inline_dispatch:
+        outbox.dispatch_inline(db, event, mongodb=mongoDB, redis=redis, timescale=timescale)
     return db_sensor
+def get_stream_sensor_ids(mongodb: MongoDBClient, sensor_ids: Optional[List[int]], sensor_type: Optional[str], latitude: Optional[float], longitude: Optional[float], radius: Optional[float]) -> Optional[set]:
+    # Converteix els filtres d'una subscripció en directe en el conjunt de sensors que la compleixen (None si no n'hi ha cap: tots).
+    # El tipus i la zona es resolen a mongoDB en subscriure's, com a get_sensors_near
+    query = {}
+    if sensor_type is not None:
+        query["type"] = sensor_type
+    if radius is not None:
+        query["latitude"] = {"$gte": latitude - radius, "$lte": latitude + radius}
+        query["longitude"] = {"$gte": longitude - radius, "$lte": longitude + radius}
+    if not query:
+        return set(sensor_ids) if sensor_ids else None
+    if sensor_ids:
+        query["id"] = {"$in": sensor_ids}
+    mongodb.getDatabase('DB')
+    mongodb.getCollection('sensors')
+    return {document['id'] for document in mongodb.getDocuments(query)}
 def get_sensors_near(mongodb: MongoDBClient, latitude: float, longitude: float,radius:float,redis:RedisClient,db:Session) -> List:
     #Accedeix a la base de dades i la col·lecció de mongoDB
     mongodb.getDatabase('DB')
@@ -177,26 +321,37 @@ def get_sensors_near(mongodb: MongoDBClient, latitude: float, longitude: float,r
     
     #Recuperem els documents que compleixin la condició 
     sensors_near = list(mongodb.getDocuments(query))
-    #Per cada document obtigut actualitzem les seves dades
-    for sensor in sensors_near:
-        #Obtenim les dades de postgreSQL
-        db_sensor=get_sensor(db=db,sensor_id=sensor['id'])
-        #Obtenim les dades de redis
-        db_data=get_data(redis=redis,sensor_id=db_sensor.id,sensor_name=db_sensor.name,to_date=None,from_date=None,bucket=None,timescale=None)
-        #Les afegim al document
-        sensor['velocity']=db_data['velocity']
-        sensor['temperature']=db_data['temperature']
-        sensor['humidity']=db_data['humidity']
-        sensor['battery_level']=db_data['battery_level']
-        sensor['last_seen']=db_data['last_seen']
-    print(sensors_near)
+    #Obtenim les últimes dades de tots els sensors de redis en una sola petició
+    latest_data = get_latest_data(redis, [sensor['id'] for sensor in sensors_near])
+    #Les afegim a cada document
+    for sensor, db_data in zip(sensors_near, latest_data):
+        for field in SENSOR_DATA_FIELDS:
+            sensor[field] = db_data[field] if db_data else None
     return sensors_near
-def get_sensor_mongoDB(mongoDB:MongoDBClient,sensor_id:int)->schemas.Sensor:
+def get_sensor_mongoDB(mongoDB:MongoDBClient,sensor_id:int)->Optional[schemas.Sensor]:
     #Accedeix a la base de dades i la col·lecció de mongoDB
     mongoDB.getDatabase('DB')
     mongoDB.getCollection('sensors')
-    #Retorna el document amb els camps longitud i latitud
+    #Retorna el document amb els camps longitud i latitud, o None si no hi és (no existeix o encara no s'ha propagat)
     document=mongoDB.getDocument({'id': sensor_id})
+    if document is None:
+        return None
+    return _sensor_document(document)
+
+def get_pending_sensor(db: Session, sensor_id: int) -> Optional[schemas.Sensor]:
+    # Un sensor creat a PostgreSQL que el consumidor encara no ha propagat a mongoDB: el document és al seu esdeveniment de l'outbox.
+    # Només es consulta quan mongoDB no el té
+    if get_sensor(db, sensor_id) is None:
+        return None
+    event = (db.query(models.Outbox)
+             .filter(models.Outbox.event_type == events.SENSOR_CREATED, models.Outbox.payload["id"].as_integer() == sensor_id)
+             .order_by(models.Outbox.id.desc())
+             .first())
+    if event is None:
+        return None
+    return _sensor_document(dict(event.payload))
+
+def _sensor_document(document: dict) -> dict:
     document['longitude']=document['location']['coordinates'][0]
     document['latitude']=document['location']['coordinates'][1]
     del document['location']
@@ -243,6 +398,12 @@ def get_temperature_values(mongodb: MongoDBClient, cassandra: CassandraClient):
     return {'sensors': sensors}
 
 
+def get_fleet_analytics(timescale: Timescale, from_date: Optional[str], to_date: Optional[str], top: int, z_threshold: float) -> dict:
+    # Estadístiques de tots els sensors en una sola consulta, en lloc de cridar get_data per a cada sensor
+    if top < 1:
+        raise HTTPException(status_code=400, detail="top must be a positive integer")
+    return analytics.fleet_summary(timescale, from_date=from_date, to_date=to_date, top=top, z_threshold=z_threshold)
+
 def get_sensors_quantity(db: Session, cassandra: CassandraClient):
     # Obtenim la quantitat de sensors que hi ha de cada tipus
     query = """
@@ -257,22 +418,24 @@ def get_sensors_quantity(db: Session, cassandra: CassandraClient):
         sensors.append({"type": row.type, "quantity": row.quantity})
     return {'sensors': sensors}
 
-def get_low_battery_sensors(mongodb: MongoDBClient, cassandra: CassandraClient):
-    # Obtenim els sensors que tenen el nivell de bateria per sota del 20%
-    query = """
-        SELECT id, battery_level
-        FROM sensor.battery
-        WHERE battery_level < 0.2
-        ALLOW FILTERING;
-    """
-    results = cassandra.execute(query)
+def get_low_battery_sensors(mongodb: MongoDBClient, redis: RedisClient):
+    # Els sensors amb la bateria per sota del llindar són al conjunt que es manté en enregistrar les lectures
+    sensor_ids = sorted(int(sensor_id) for sensor_id in redis.smembers(LOW_BATTERY_KEY))
+    battery = {sensor_id: data["battery_level"]
+               for sensor_id, data in zip(sensor_ids, get_latest_data(redis, sensor_ids, ["battery_level"])) if data is not None}
+    #Obtenim les dades de tots els sensors de mongoDB en una sola consulta
+    mongodb.getDatabase('DB')
+    mongodb.getCollection('sensors')
+    documents = {document['id']: document for document in mongodb.getDocuments({'id': {'$in': list(battery)}})}
     sensors = []
-
-    for row in results:
-        #Obtenim totes les dades del sensor 
-        sensor=get_sensor_mongoDB(mongodb,row.id)
+    for sensor_id in sensor_ids:
+        document = documents.get(sensor_id)
+        if document is None or sensor_id not in battery:
+            continue
+        document['longitude']=document['location']['coordinates'][0]
+        document['latitude']=document['location']['coordinates'][1]
+        del document['location']
         #Hi afegim el nivell de bateria
-        sensor.update({"battery_level": round(row.battery_level, 2)})
-        sensors.append(sensor)
-    print(sensors)
+        document["battery_level"] = round(battery[sensor_id], 2)
+        sensors.append(document)
     return {'sensors': sensors}
\ No newline at end of file
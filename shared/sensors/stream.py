@@ -0,0 +1,139 @@
+import asyncio
+import collections
+import json
+import threading
+import time
+from typing import Optional, Set
+
+from shared import backends, connections, metrics
+from shared.sensors.keys import LIVE_CHANNEL
+
+# Lectures en directe per als clients subscrits (Server-Sent Events). En enregistrar un lot de lectures es publica
+# un sol missatge al canal de Redis LIVE_CHANNEL. Cada procés de l'API hi té una única subscripció i un fil que reparteix
+# les lectures entre els seus clients. Cada client té un buffer limitat: si no les llegeix a temps es descarten les més antigues
+
+subscribers = metrics.registry.gauge("stream_subscribers", "Clients subscribed to the live readings")
+dropped_readings = metrics.registry.counter("stream_dropped_readings_total", "Live readings dropped because a client was too slow")
+
+def live_message(readings) -> str:
+    # readings: (id del sensor, dades de la lectura)
+    return json.dumps([{"id": sensor_id, **data} for sensor_id, data in readings], separators=(",", ":"))
+
+class Subscription:
+    def __init__(self, sensor_ids: Optional[Set[int]], size: int, loop: asyncio.AbstractEventLoop):
+        # sensor_ids None vol dir tots els sensors
+        self.sensor_ids = sensor_ids
+        self.readings = collections.deque(maxlen=size)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def wants(self, sensor_id: int) -> bool:
+        return self.sensor_ids is None or sensor_id in self.sensor_ids
+
+    def put(self, reading: dict):
+        # Es crida des del fil que escolta Redis. El deque amb maxlen descarta la lectura més antiga quan és ple
+        with self._lock:
+            if len(self.readings) == self.readings.maxlen:
+                self.dropped += 1
+                dropped_readings.inc()
+            self.readings.append(reading)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # El bucle del client ja s'ha tancat
+            pass
+
+    async def get(self, timeout: float):
+        # Espera com a molt timeout segons i retorna les lectures pendents i quantes se n'han descartat des de l'última crida
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        with self._lock:
+            readings, dropped = list(self.readings), self.dropped
+            self.readings.clear()
+            self.dropped = 0
+        return readings, dropped
+
+class LiveHub:
+    def __init__(self, redis):
+        self._redis = redis
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._pubsub = None
+        self._thread = None
+
+    def subscribe(self, sensor_ids: Optional[Set[int]], size: int) -> Subscription:
+        # S'ha de cridar des del bucle d'asyncio del client. La subscripció a Redis es fa amb el primer client,
+        # i es torna a fer si el fil que escolta s'ha aturat
+        subscription = Subscription(sensor_ids, size, asyncio.get_running_loop())
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._thread is not None:
+                    print("Live readings listener had stopped, restarting it")
+                    self._close_pubsub()
+                self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(LIVE_CHANNEL)
+                self._thread = threading.Thread(target=self._listen, name="live-readings", daemon=True)
+                self._thread.start()
+            self._subscriptions.add(subscription)
+            subscribers.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            subscribers.set(len(self._subscriptions))
+
+    def _close_pubsub(self):
+        try:
+            self._pubsub.close()
+        except Exception as e:
+            print(f"Could not close the live readings subscription: {e!r}")
+
+    def _listen(self):
+        pubsub = self._pubsub
+        while True:
+            try:
+                message = pubsub.get_message(timeout=1.0)
+            except Exception as e:
+                # redis-py es torna a connectar i a subscriure en la següent crida
+                print(f"Live readings lost the connection to Redis: {e!r}")
+                time.sleep(1)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            # Un missatge mal format o un client que falla no ha d'aturar el fil: els altres clients es quedarien sense lectures
+            try:
+                self._dispatch(message["data"])
+            except Exception as e:
+                print(f"Could not deliver live readings {message['data']!r}: {e!r}")
+
+    def _dispatch(self, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for reading in json.loads(data):
+            for subscription in subscriptions:
+                try:
+                    if subscription.wants(reading["id"]):
+                        subscription.put(reading)
+                except Exception as e:
+                    print(f"Could not deliver a live reading to a subscriber: {e!r}")
+
+def hub() -> LiveHub:
+    return connections.per_process("live_hub", lambda: LiveHub(backends.redis_client()))
+
+async def events(subscription: Subscription, request, heartbeat: float):
+    # Format text/event-stream: un esdeveniment "reading" per lectura, "dropped" si se n'han perdut i un comentari
+    # periòdic perquè els proxies no tanquin la connexió
+    while not await request.is_disconnected():
+        readings, dropped = await subscription.get(heartbeat)
+        if dropped:
+            yield f"event: dropped\ndata: {json.dumps({'dropped': dropped})}\n\n"
+        for reading in readings:
+            yield f"event: reading\ndata: {json.dumps(reading, separators=(',', ':'))}\n\n"
+        if not readings and not dropped:
+            yield ": keep-alive\n\n"
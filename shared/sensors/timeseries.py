@@ -0,0 +1,58 @@
+import datetime
+from typing import Iterable, List, Optional
+
+EPOCH = datetime.datetime(1970, 1, 1)
+# Origen que fa servir time_bucket de TimescaleDB per als intervals de setmanes (un dilluns)
+WEEK_ORIGIN = datetime.datetime(2000, 1, 3)
+BUCKET_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+BUCKETS = ("minute", "hour", "day", "week", "month", "year")
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    # La columna last_seen és un timestamp sense zona horària: igual que PostgreSQL, ignorem la zona de l'entrada
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+def to_score(value: str) -> float:
+    return (parse_timestamp(value) - EPOCH).total_seconds()
+
+def time_bucket(bucket: str, timestamp: datetime.datetime) -> datetime.datetime:
+    # Mateixos límits d'interval que time_bucket('1 <bucket>', ...) de TimescaleDB
+    if bucket in BUCKET_SECONDS:
+        seconds = (timestamp - EPOCH).total_seconds()
+        return EPOCH + datetime.timedelta(seconds=seconds - seconds % BUCKET_SECONDS[bucket])
+    if bucket == "week":
+        return WEEK_ORIGIN + datetime.timedelta(weeks=(timestamp - WEEK_ORIGIN) // datetime.timedelta(weeks=1))
+    if bucket == "month":
+        return datetime.datetime(timestamp.year, timestamp.month, 1)
+    if bucket == "year":
+        return datetime.datetime(timestamp.year, 1, 1)
+    raise ValueError(f"Unknown bucket: {bucket}")
+
+def next_bucket(bucket: str, start: datetime.datetime) -> datetime.datetime:
+    # Inici de l'interval que segueix el que comença a start
+    if bucket in BUCKET_SECONDS:
+        return start + datetime.timedelta(seconds=BUCKET_SECONDS[bucket])
+    if bucket == "week":
+        return start + datetime.timedelta(weeks=1)
+    if bucket == "month":
+        return datetime.datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    if bucket == "year":
+        return datetime.datetime(start.year + 1, 1, 1)
+    raise ValueError(f"Unknown bucket: {bucket}")
+
+def _average(values: List[Optional[float]]) -> Optional[float]:
+    # Com AVG de SQL: ignora els valors nuls i retorna None si no n'hi ha cap
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+def aggregate_buckets(sensor_id: int, readings: Iterable[dict], bucket: str) -> List[tuple]:
+    # Agrupa les lectures per intervals de temps i retorna les mateixes files que la consulta de TimescaleDB de get_data
+    buckets = {}
+    for reading in readings:
+        buckets.setdefault(time_bucket(bucket, parse_timestamp(reading["last_seen"])), []).append(reading)
+    return [
+        (sensor_id, start,
+         _average([reading.get("velocity") for reading in group]),
+         _average([reading.get("temperature") for reading in group]),
+         _average([reading.get("humidity") for reading in group]))
+        for start, group in sorted(buckets.items())
+    ]
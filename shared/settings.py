@@ -12,6 +12,82 @@ class Settings(BaseSettings):
     db_password: str = os.getenv("DB_PASSWORD")
     db_host: str = os.getenv("DB_HOST")
     db_port: str = os.getenv("DB_PORT")
+    # Connexions al PostgreSQL primari de cada procés (més les de desbordament) i segons que una petició pot esperar-ne una de lliure
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", 10))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    # Rèpliques de lectura de PostgreSQL (host o host:port, separats per comes; buit, sense rèpliques) i connexions a cadascuna
+    db_replica_hosts: str = os.getenv("DB_REPLICA_HOSTS", "")
+    db_replica_pool_size: int = int(os.getenv("DB_REPLICA_POOL_SIZE", 10))
+    # Segons després d'una escriptura en què les lectures del procés van al primari en lloc de les rèpliques.
+    # Els altres processos (workers de gunicorn, instàncies) no ho saben i poden llegir d'una rèplica endarrerida
+    db_read_your_writes: float = float(os.getenv("DB_READ_YOUR_WRITES", 2))
+
+    # Backends de les bases de dades i la cua: "live" (els serveis del docker-compose) o "memory" (en memòria, vegeu shared/backends.py)
+    backend: str = os.getenv("BACKEND", "live")
+    # Segons màxims que s'espera un servei en arrencar (migracions, consumidor) i que pot tardar cada comprovació de /health/ready
+    startup_timeout: float = float(os.getenv("STARTUP_TIMEOUT", 60))
+    readiness_timeout: float = float(os.getenv("READINESS_TIMEOUT", 2))
+    # Connexions a TimescaleDB de cada procés i segons que una petició pot esperar-ne una de lliure
+    timescale_pool_size: int = int(os.getenv("TIMESCALE_POOL_SIZE", 20))
+    timescale_pool_timeout: float = float(os.getenv("TIMESCALE_POOL_TIMEOUT", 10))
+    # Escriptures a Cassandra que cada procés pot tenir enviades sense resposta
+    cassandra_max_in_flight: int = int(os.getenv("CASSANDRA_MAX_IN_FLIGHT", 1024))
+    # Nombre de lectures recents que es guarden a Redis per sensor
+    redis_recent_readings: int = int(os.getenv("REDIS_RECENT_READINGS", 1000))
+    # Nivell de bateria per sota del qual un sensor es considera amb bateria baixa i es publica un avís
+    low_battery_threshold: float = float(os.getenv("LOW_BATTERY_THRESHOLD", 0.2))
+    # Lectures en directe que es guarden per a cada client subscrit abans de descartar les més antigues,
+    # i segons entre els comentaris que mantenen la connexió oberta quan no n'arriba cap
+    stream_buffer_size: int = int(os.getenv("STREAM_BUFFER_SIZE", 100))
+    stream_heartbeat: float = float(os.getenv("STREAM_HEARTBEAT", 15))
+    # Arxiu de sensor_data en fitxers Parquet (vegeu shared/sensors/archive.py): directori o URI (buit, sense arxiu),
+    # dies que les lectures es queden a TimescaleDB i segons entre execucions de l'arxivador
+    archive_uri: str = os.getenv("ARCHIVE_URI", "")
+    archive_after_days: int = int(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+    archive_interval: int = int(os.getenv("ARCHIVE_INTERVAL", 3600))
+    # Si és fals, l'API respon després del commit i el relay de l'outbox publica l'esdeveniment a la cua.
+    # Si és cert, l'API propaga els canvis a la resta de bases de dades just després del commit (els tests ho activen)
+    outbox_inline_dispatch: bool = os.getenv("OUTBOX_INLINE_DISPATCH", "false").lower() == "true"
+    # Si és cert, l'API publica les lectures dels sensors a la cua i el consumidor les escriu a les bases de dades
+    ingest_via_queue: bool = os.getenv("INGEST_VIA_QUEUE", "false").lower() == "true"
+    # Si és cert, els sensors que entren o surten del conjunt de bateria baixa es publiquen a la cua d'avisos (cal RabbitMQ)
+    battery_alerts: bool = os.getenv("BATTERY_ALERTS", "true").lower() == "true"
+    # Nombre de cues entre les quals es reparteixen les lectures segons l'id del sensor
+    queue_shards: int = int(os.getenv("QUEUE_SHARDS", 4))
+    # Mida màxima de cada cua (0 sense límit) i què fa el broker quan és plena
+    queue_max_length: int = int(os.getenv("QUEUE_MAX_LENGTH", 100000))
+    queue_overflow: str = os.getenv("QUEUE_OVERFLOW", "reject-publish")
+    # Lectures que l'API pot guardar mentre el broker no les accepta
+    publisher_buffer_size: int = int(os.getenv("PUBLISHER_BUFFER_SIZE", 10000))
+    # Què fa l'API amb les lectures quan la cua està sobrecarregada: "reject" respon 429, "coalesce" només guarda l'última de cada sensor
+    overload_policy: str = os.getenv("OVERLOAD_POLICY", "reject")
+    # Segons que s'indiquen a la capçalera Retry-After de les respostes 429
+    ingest_retry_after: int = int(os.getenv("INGEST_RETRY_AFTER", 1))
+    # Reintents d'un missatge que falla abans d'enviar-lo a la cua de dead letters, i espera entre reintents (ms)
+    consumer_max_retries: int = int(os.getenv("CONSUMER_MAX_RETRIES", 5))
+    consumer_retry_delay: int = int(os.getenv("CONSUMER_RETRY_DELAY", 5000))
+    # Missatges sense confirmar que pot tenir cada consumidor
+    consumer_prefetch: int = int(os.getenv("CONSUMER_PREFETCH", 1000))
+    # El consumidor agrupa els missatges en lots de com a màxim consumer_batch_size o consumer_batch_window segons
+    consumer_batch_size: int = int(os.getenv("CONSUMER_BATCH_SIZE", 500))
+    consumer_batch_window: float = float(os.getenv("CONSUMER_BATCH_WINDOW", 0.2))
+    # Port on el consumidor exposa /metrics
+    consumer_metrics_port: int = int(os.getenv("CONSUMER_METRICS_PORT", 9100))
+    # Segons que recordem una lectura ja processada per descartar duplicats
+    dedup_ttl: int = int(os.getenv("DEDUP_TTL", 3600))
+    # Shards que consumeix cada consumidor, separats per comes (per defecte tots)
+    consumer_shards: str = os.getenv("CONSUMER_SHARDS", "")
+
+    @property
+    def assigned_shards(self) -> list:
+        if not self.consumer_shards:
+            return list(range(self.queue_shards))
+        return [int(shard) for shard in self.consumer_shards.split(",")]
+
+    @property
+    def replica_hosts(self) -> list:
+        return [host.strip() for host in self.db_replica_hosts.split(",") if host.strip()]
     
     @property
     def db_name(self) -> str:
@@ -29,4 +105,7 @@ class Settings(BaseSettings):
     
     class Config:
         env_file = ".env"
-        env_file_encoding = "utf-8"
\ No newline at end of file
+        env_file_encoding = "utf-8"
+
+
+settings = Settings()
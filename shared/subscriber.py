@@ -1,30 +1,59 @@
 import pika
+from pika.exceptions import AMQPError
 import time
 
-from shared.publisher import QUEUE_NAME
+from shared.backoff import retry
+from shared.publisher import declare_retry_topology, declare_topology, queue_name
 
 class Subscriber:
-    def __init__(self):
+    def __init__(self, host='localhost', shards=4, assigned_shards=None, max_length=None, overflow="reject-publish", retry_delay=5000, prefetch=500,
+                 wait_timeout=60):
         credentials = pika.PlainCredentials('guest', 'guest')
         # Change the host to rabbitmq
-        parameters = pika.ConnectionParameters('localhost',
+        parameters = pika.ConnectionParameters(host,
                                        5672,
                                        '/',
                                        credentials)
-        try:
-            self.conn = pika.BlockingConnection(parameters)
-        except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+        # Espera que RabbitMQ accepti connexions, amb espera exponencial i com a molt wait_timeout segons
+        self.conn = retry(lambda: pika.BlockingConnection(parameters), timeout=wait_timeout, exceptions=(AMQPError,), description="RabbitMQ")
         self.channel = self.conn.channel()
+        self.shards = shards
+        # Els arguments de les cues han de coincidir amb els del publicador
+        self.max_length = max_length
+        self.overflow = overflow
+        self.retry_delay = retry_delay
+        self.prefetch = prefetch
+        # Shards que consumeix aquest procés. Per defecte tots
+        self.assigned_shards = list(range(shards)) if assigned_shards is None else assigned_shards
 
 
+    def _consume(self, callback):
+        declare_topology(self.channel, self.shards, self.max_length, self.overflow)
+        declare_retry_topology(self.channel, self.shards, self.retry_delay)
+        # Confirmació manual: el callback fa ack quan les dades ja s'han escrit
+        self.channel.basic_qos(prefetch_count=self.prefetch)
+        for shard in self.assigned_shards:
+            self.channel.basic_consume(queue=queue_name(shard), on_message_callback=callback, auto_ack=False)
+
     def subscribe(self, callback):
-        result = self.channel.queue_declare(queue=QUEUE_NAME)
-        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
+        self._consume(callback)
         self.channel.start_consuming()
 
+    def subscribe_batches(self, callback, batch_size=500, window=0.2):
+        # Acumula missatges durant window segons (o fins a batch_size) i els passa junts a callback(channel, deliveries),
+        # on cada entrega és (method, properties, body)
+        deliveries = []
+        self._consume(lambda ch, method, properties, body: deliveries.append((method, properties, body)))
+        while True:
+            deadline = time.monotonic() + window
+            while len(deliveries) < batch_size and time.monotonic() < deadline:
+                self.conn.process_data_events(time_limit=max(0, deadline - time.monotonic()))
+            if deliveries:
+                batch = list(deliveries)
+                deliveries.clear()
+                callback(self.channel, batch)
+
     def close(self):
         self.conn.close()
 
-    
\ No newline at end of file
+    
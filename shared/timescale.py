@@ -1,29 +1,74 @@
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import os
+import threading
+from shared import connections, metrics
+from shared.settings import settings
 
 
-class Timescale:
-    def __init__(self):
-        self.conn = psycopg2.connect(
+class ConnectionPool:
+    # Pool de connexions del procés. A diferència de ThreadedConnectionPool, getconn() espera una connexió lliure en lloc de fallar
+    def __init__(self, size, **params):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, size, **params)
+        self._slots = threading.BoundedSemaphore(size)
+
+    def getconn(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError("Timed out waiting for a TimescaleDB connection")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+def _pool():
+    return ConnectionPool(settings.timescale_pool_size,
             host=os.environ.get("TS_HOST"),
             port=os.environ.get("TS_PORT"),
             user=os.environ.get("TS_USER"),
             password=os.environ.get("TS_PASSWORD"),
             database=os.environ.get("TS_DBNAME"))
+
+
+class Timescale:
+    # Cada instància agafa una connexió del pool del procés i té el seu propi cursor: no es comparteixen entre fils
+    def __init__(self):
+        self._pool = connections.per_process("timescale", _pool)
+        self.conn = self._pool.getconn(timeout=settings.timescale_pool_timeout)
         self.cursor = self.conn.cursor()
         
     def getCursor(self):
             return self.cursor
 
     def close(self):
+        # Retorna la connexió al pool sense cap transacció a mitges
         self.cursor.close()
-        self.conn.close()
+        if not self.conn.closed:
+            self.conn.rollback()
+        self._pool.putconn(self.conn)
     
+    def rollback(self):
+        self.conn.rollback()
+
     def ping(self):
-        return self.conn.ping()
+        self.cursor.execute("SELECT 1")
+        return self.cursor.fetchone() == (1,)
     
-    def execute(self, query):
-       return self.cursor.execute(query)
+    @metrics.timed("timescale")
+    def execute(self, query, parameters=None):
+       return self.cursor.execute(query, parameters)
+
+    # Executa una consulta amb "VALUES %s" per a moltes files en una sola anada i tornada
+    @metrics.timed("timescale")
+    def execute_values(self, query, rows):
+        return psycopg2.extras.execute_values(self.cursor, query, rows)
     
     def delete(self, table):
         self.cursor.execute("DELETE FROM " + table)
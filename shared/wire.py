@@ -0,0 +1,74 @@
+import json
+import struct
+from typing import Iterable, List, Tuple
+
+# Format binari de les lectures dels sensors que es publiquen a la cua.
+# Un missatge és una capçalera (versió, nombre de lectures) seguida de les lectures, totes amb la mateixa estructura:
+# id del sensor, bits dels camps presents, velocity, temperature, humidity, battery_level i last_seen (UTF-8 amb la mida davant).
+# Com que les lectures són independents, dos missatges es poden ajuntar sumant els comptadors i concatenant les lectures.
+
+VERSION = 1
+READINGS_CONTENT_TYPE = f"application/vnd.sensor-readings.v{VERSION}"
+JSON_CONTENT_TYPE = "application/json"
+
+READING_FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+SENSOR_DATA = "sensor_data"
+
+_HEADER = struct.Struct("!BI")
+_READING = struct.Struct("!IBddddH")
+
+def encode_readings(readings: Iterable[Tuple[int, dict]]) -> bytes:
+    count = 0
+    parts = [b""]
+    for sensor_id, data in readings:
+        flags = 0
+        values = []
+        for bit, field in enumerate(READING_FIELDS):
+            value = data.get(field)
+            if value is not None:
+                flags |= 1 << bit
+            values.append(0.0 if value is None else value)
+        last_seen = data["last_seen"].encode()
+        parts.append(_READING.pack(sensor_id, flags, *values, len(last_seen)))
+        parts.append(last_seen)
+        count += 1
+    parts[0] = _HEADER.pack(VERSION, count)
+    return b"".join(parts)
+
+def merge_readings(bodies: Iterable[bytes]) -> bytes:
+    count = 0
+    parts = [b""]
+    for body in bodies:
+        version, n = _HEADER.unpack_from(body)
+        if version != VERSION:
+            raise ValueError(f"Unsupported readings version: {version}")
+        count += n
+        parts.append(body[_HEADER.size:])
+    parts[0] = _HEADER.pack(VERSION, count)
+    return b"".join(parts)
+
+def decode_readings(body: bytes) -> List[Tuple[int, dict]]:
+    version, count = _HEADER.unpack_from(body)
+    if version != VERSION:
+        raise ValueError(f"Unsupported readings version: {version}")
+    offset = _HEADER.size
+    readings = []
+    for _ in range(count):
+        sensor_id, flags, *values, size = _READING.unpack_from(body, offset)
+        offset += _READING.size
+        data = {field: value if flags & (1 << bit) else None for bit, (field, value) in enumerate(zip(READING_FIELDS, values))}
+        data["last_seen"] = body[offset:offset + size].decode()
+        offset += size
+        readings.append((sensor_id, data))
+    if offset != len(body):
+        raise ValueError("Trailing bytes after the last reading")
+    return readings
+
+def decode(body: bytes, content_type: str) -> List[Tuple[str, dict]]:
+    # Retorna els missatges continguts al cos com a parells (tipus, payload)
+    if content_type == READINGS_CONTENT_TYPE:
+        return [(SENSOR_DATA, {"id": sensor_id, **data}) for sensor_id, data in decode_readings(body)]
+    if content_type in (None, JSON_CONTENT_TYPE):
+        data = json.loads(body)
+        return [(data.get("type"), data.get("payload", data))]
+    raise ValueError(f"Unsupported content type: {content_type}")